@@ -0,0 +1,32 @@
+# Per-call overhead of the InfluxDB readiness check.
+#
+# "probe" is the full lsof + ping check that used to run on every
+# Database.set/get, "is_ready" is the cached check that runs now.
+#
+#   python3 benchmarks/database_ready.py [iterations]
+import sys
+import time
+
+from pm_dashboard.database import Database
+
+def bench(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    db = Database('pm_dashboard_bench')
+    ready = db.probe()
+    print(f"InfluxDB ready: {ready}")
+
+    probe = bench(db._probe, iterations)
+    cached = bench(db.is_ready, iterations * 100)
+    print(f"probe (before): {probe * 1e6:10.1f} us/call")
+    print(f"is_ready (after): {cached * 1e6:8.1f} us/call")
+    print(f"speedup: {probe / cached:.0f}x")
+    db.close()
+
+if __name__ == '__main__':
+    main()
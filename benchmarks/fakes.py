@@ -0,0 +1,119 @@
+# Deterministic stand-ins for sf_rpi_status and spc, so benchmarks run on
+# any machine and two runs see the same data.
+#
+#   import fakes
+#   fakes.install()
+#   from pm_dashboard.data_logger import DataLogger
+import math
+import random
+import sys
+import types
+from collections import namedtuple
+
+CPU_COUNT = 4
+DISKS = ['mmcblk0', 'nvme0n1', 'sda']
+INTERFACES = ['eth0', 'wlan0']
+
+CpuFreq = namedtuple('CpuFreq', ['current', 'min', 'max'])
+MemoryInfo = namedtuple('MemoryInfo', ['total', 'available', 'percent', 'used', 'free'])
+DiskInfo = namedtuple('DiskInfo', ['total', 'used', 'free', 'percent', 'mounted'])
+NetworkSpeed = namedtuple('NetworkSpeed', ['upload', 'download'])
+
+class Sensors:
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        self.tick = 0
+
+    def wave(self, period, low, high):
+        # Smooth value with a little noise, advances on every call
+        self.tick += 1
+        value = (math.sin(self.tick * 2 * math.pi / period) + 1) / 2
+        return low + (high - low) * value + self.random.uniform(-1, 1)
+
+__sensors__ = Sensors()
+
+def get_cpu_temperature():
+    return round(__sensors__.wave(600, 40, 70), 1)
+
+def get_gpu_temperature():
+    return round(__sensors__.wave(600, 38, 65), 1)
+
+def get_cpu_percent(percpu=False):
+    if percpu:
+        return [round(__sensors__.wave(60, 0, 100), 1) for _ in range(CPU_COUNT)]
+    return round(__sensors__.wave(60, 0, 100), 1)
+
+def get_cpu_freq():
+    return CpuFreq(round(__sensors__.wave(120, 600, 2400)), 600, 2400)
+
+def get_cpu_count():
+    return CPU_COUNT
+
+def get_memory_info():
+    total = 8 * 1024 ** 3
+    used = int(__sensors__.wave(300, 0.2, 0.8) * total)
+    return MemoryInfo(total, total - used, round(used / total * 100, 1), used, total - used)
+
+def get_disks():
+    return list(DISKS)
+
+def get_disk_info(path='/'):
+    return get_disks_info()[DISKS[0]]
+
+def get_disks_info():
+    disks = {}
+    for disk in DISKS:
+        total = 256 * 1024 ** 3
+        used = int(total * 0.4)
+        disks[disk] = DiskInfo(total, used, total - used, 40.0, True)
+    return disks
+
+def get_boot_time():
+    return 1700000000.0
+
+def get_ips():
+    return {interface: f'192.168.1.{i + 10}' for i, interface in enumerate(INTERFACES)}
+
+def get_macs():
+    return {interface: f'dc:a6:32:00:00:{i:02x}' for i, interface in enumerate(INTERFACES)}
+
+def get_network_connection_type():
+    return ['Wired']
+
+def get_network_speed():
+    return NetworkSpeed(int(__sensors__.wave(30, 0, 1e6)), int(__sensors__.wave(30, 0, 1e7)))
+
+class PWMFan:
+    def __init__(self):
+        self._is_ready = True
+
+    def get_speed(self):
+        return round(__sensors__.wave(120, 0, 5000))
+
+class SPC:
+    def read_all(self):
+        return {
+            'input_voltage': round(__sensors__.wave(60, 4900, 5100)),
+            'input_current': round(__sensors__.wave(60, 500, 2500)),
+            'battery_voltage': round(__sensors__.wave(3600, 7000, 8400)),
+            'battery_percentage': round(__sensors__.wave(3600, 20, 100)),
+            'is_charging': True,
+            'is_plugged_in': True,
+            'fan_power': 50,
+        }
+
+def install(seed=0):
+    # Must run before pm_dashboard is imported
+    global __sensors__
+    __sensors__ = Sensors(seed)
+    module = types.ModuleType('sf_rpi_status')
+    for name, value in list(globals().items()):
+        if name.startswith('get_') or name == 'PWMFan':
+            setattr(module, name, value)
+    sys.modules['sf_rpi_status'] = module
+    spc = types.ModuleType('spc')
+    spc_spc = types.ModuleType('spc.spc')
+    spc_spc.SPC = SPC
+    spc.spc = spc_spc
+    sys.modules['spc'] = spc
+    sys.modules['spc.spc'] = spc_spc
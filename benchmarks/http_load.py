@@ -0,0 +1,70 @@
+# Latency of the dashboard HTTP server under concurrent pollers.
+#
+# Start the dashboard, then:
+#
+#   python3 benchmarks/http_load.py [--clients 20] [--duration 10] [--slow]
+#
+# --slow keeps one extra client calling /test-mqtt against an unreachable
+# broker, which used to stall every other request on the single threaded
+# server.
+import argparse
+import http.client
+import threading
+import time
+from urllib.parse import urlparse
+
+def percentile(values, p):
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    index = min(int(len(values) * p / 100), len(values) - 1)
+    return values[index]
+
+def poller(url, deadline, latencies, errors):
+    url = urlparse(url)
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+    path = url.path + (f'?{url.query}' if url.query else '')
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors.append(1)
+            conn.close()
+            conn = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:34001/api/v1.0/get-data')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--slow', action='store_true')
+    args = parser.parse_args()
+
+    deadline = time.monotonic() + args.duration
+    latencies = []
+    errors = []
+    threads = []
+    for _ in range(args.clients):
+        threads.append(threading.Thread(target=poller, args=(args.url, deadline, latencies, errors)))
+    if args.slow:
+        base = urlparse(args.url)
+        slow_url = f'{base.scheme}://{base.netloc}/api/v1.0/test-mqtt?host=192.0.2.1&port=1883&username=a&password=b'
+        threads.append(threading.Thread(target=poller, args=(slow_url, deadline, [], [])))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(f"clients: {args.clients}, requests: {len(latencies)}, errors: {len(errors)}")
+    print(f"throughput: {len(latencies) / args.duration:.1f} req/s")
+    print(f"p50: {percentile(latencies, 50) * 1000:.1f} ms")
+    print(f"p99: {percentile(latencies, 99) * 1000:.1f} ms")
+    print(f"max: {max(latencies, default=0) * 1000:.1f} ms")
+
+if __name__ == '__main__':
+    main()
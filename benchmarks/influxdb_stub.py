@@ -0,0 +1,152 @@
+# In-process stand-in for the InfluxDB 1.x HTTP API, enough for the
+# dashboard's write and query paths. Writes are parsed and counted, not
+# stored. SELECTs return generated series of the right shape: one row
+# per GROUP BY time bucket in the WHERE range, one column per selected
+# alias. Latency is added per request and per returned row to stand in
+# for the server's own work.
+#
+#   python3 benchmarks/influxdb_stub.py [--port 8086] [--latency 0.002]
+import argparse
+import json
+import math
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+GROUP_BY_TIME = re.compile(r'GROUP BY time\((\d+)s\)', re.IGNORECASE)
+TIME_RANGE = re.compile(r'time >= (\d+)(s?) AND time <= (\d+)', re.IGNORECASE)
+ALIAS = re.compile(r'as "([^"]+)"', re.IGNORECASE)
+FROM = re.compile(r'FROM ("[^"]+"\.)?"?([\w/.*]+)"?', re.IGNORECASE)
+LIMIT = re.compile(r'LIMIT (\d+)', re.IGNORECASE)
+
+def format_time(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+class InfluxDBStub:
+    def __init__(self, host='127.0.0.1', port=0, latency=0, row_latency=0):
+        # latency: seconds added to every request
+        # row_latency: seconds added per returned row
+        self.latency = latency
+        self.row_latency = row_latency
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.points = 0
+        self.queries = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                stub.handle(self)
+
+            def do_POST(self):
+                stub.handle(self)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {"writes": self.writes, "points": self.points, "queries": self.queries}
+
+    def handle(self, request):
+        url = urlparse(request.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(request.headers.get('Content-Length') or 0)
+        body = request.rfile.read(length) if length > 0 else b''
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if url.path == '/ping':
+            self.send(request, 204, None)
+        elif url.path == '/write':
+            lines = [line for line in body.split(b'\n') if line.strip() != b'']
+            with self.lock:
+                self.writes += 1
+                self.points += len(lines)
+            self.send(request, 204, None)
+        elif url.path == '/query':
+            if request.command == 'POST' and 'q' not in params:
+                params.update({key: values[0] for key, values in parse_qs(body.decode()).items()})
+            results = []
+            rows = 0
+            for i, statement in enumerate(params.get('q', '').split(';')):
+                result = self.run(statement.strip(), params.get('epoch'))
+                result['statement_id'] = i
+                rows += sum(len(series['values']) for series in result.get('series', []))
+                results.append(result)
+            with self.lock:
+                self.queries += 1
+            if self.row_latency > 0:
+                time.sleep(self.row_latency * rows)
+            self.send(request, 200, {"results": results})
+        else:
+            self.send(request, 404, {"error": "not found"})
+
+    def send(self, request, status, data):
+        body = b'' if data is None else json.dumps(data).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('X-Influxdb-Version', '1.8.10-stub')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def run(self, statement, epoch):
+        if not statement.upper().startswith('SELECT'):
+            return {}
+        source = FROM.search(statement)
+        name = source.group(2) if source else 'history'
+        columns = ALIAS.findall(statement) or ['value']
+        group_by = GROUP_BY_TIME.search(statement)
+        time_range = TIME_RANGE.search(statement)
+        if group_by is not None and time_range is not None:
+            interval = int(group_by.group(1))
+            scale = 1 if time_range.group(2) == 's' else 1000000000
+            start = int(time_range.group(1)) // scale // interval * interval
+            end = int(time_range.group(3)) // scale
+            times = range(start, end + 1, interval)
+        else:
+            limit = LIMIT.search(statement)
+            now = int(time.time())
+            times = range(now - int(limit.group(1)) + 1 if limit else now, now + 1)
+        values = []
+        for t in times:
+            row = [t if epoch == 's' else format_time(t)]
+            for i, column in enumerate(columns):
+                row.append(round(50 + 40 * math.sin(t / 600 + i), 2))
+            values.append(row)
+        if len(values) == 0:
+            return {}
+        return {"series": [{"name": name, "columns": ['time'] + columns, "values": values}]}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8086)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--row-latency', type=float, default=0)
+    args = parser.parse_args()
+    stub = InfluxDBStub(args.host, args.port, args.latency, args.row_latency)
+    print(f"InfluxDB stub listening on {stub.host}:{stub.port}")
+    stub.server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# Time from a cold interpreter to a serving dashboard, with the sensor
+# fakes from benchmarks/fakes.py. Each run is a fresh process, the same
+# as a service restart.
+#
+#   python3 benchmarks/startup.py [--runs 5] [--history]
+#
+# --history starts with history enabled. InfluxDB doesn't need to be
+# running, history comes up in the background and doesn't delay serving.
+import argparse
+import json
+import subprocess
+import sys
+import time
+from os import path
+
+BENCHMARKS_PATH = path.dirname(path.abspath(__file__))
+ROOT_PATH = path.dirname(BENCHMARKS_PATH)
+
+def child(history):
+    # Runs in the measured process, prints its timings as JSON
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT_PATH)
+    import fakes
+    fakes.install()
+    import http.client
+    import socket
+    from pm_dashboard import pm_dashboard
+    imported = time.perf_counter()
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    pm_dashboard.__host__ = '127.0.0.1'
+    pm_dashboard.__port__ = port
+    dashboard = pm_dashboard.PMDashboard(
+        device_info={'id': 'pm_dashboard_bench', 'version': '0.0.0'},
+        database='pm_dashboard_bench',
+        config={'system': {'data_interval': 1, 'enable_history': history}})
+    constructed = time.perf_counter()
+    dashboard.start()
+    while True:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', f'{pm_dashboard.__api_prefix__}/get-data')
+            if conn.getresponse().status == 200:
+                break
+        except OSError:
+            time.sleep(0.001)
+    serving = time.perf_counter()
+    print(json.dumps({
+        "import_ms": (imported - start) * 1000,
+        "construct_ms": (constructed - imported) * 1000,
+        "start_to_serving_ms": (serving - constructed) * 1000,
+        "total_ms": (serving - start) * 1000,
+    }))
+
+def measure(runs=5, history=False):
+    samples = []
+    for _ in range(runs):
+        command = [sys.executable, path.abspath(__file__), '--child']
+        if history:
+            command.append('--history')
+        start = time.perf_counter()
+        output = subprocess.run(command, capture_output=True, text=True, cwd=BENCHMARKS_PATH, timeout=60).stdout
+        wall = time.perf_counter() - start
+        sample = json.loads(output.strip().splitlines()[-1])
+        # Includes interpreter startup
+        sample["process_ms"] = wall * 1000
+        samples.append(sample)
+    result = {"runs": runs, "history": history}
+    for key in samples[0]:
+        values = sorted(sample[key] for sample in samples)
+        result[key] = {"median": round(values[len(values) // 2], 2), "max": round(values[-1], 2)}
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--history', action='store_true')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.history)
+        return
+    print(json.dumps(measure(args.runs, args.history), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+# Benchmark suite for the hot paths, runs anywhere: sensors come from
+# benchmarks/fakes.py and InfluxDB from benchmarks/influxdb_stub.py.
+# Benchmarks the working tree, not the installed package. Results are
+# written as JSON, compare files across releases to spot regressions.
+#
+#   python3 benchmarks/suite.py [--output results.json] [--quick]
+#       [--only get_data,write_path,time_range,get_log,http,startup]
+#       [--latency 0.002] [--row-latency 0.00001] [--log-sizes 10,100,1000]
+#       [--clients 20] [--duration 5] [--server-mode pool]
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import threading
+import time
+from os import makedirs, path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import fakes
+fakes.install()
+
+from http_load import poller, percentile
+from influxdb_stub import InfluxDBStub
+import startup
+from pm_dashboard import __version__
+from pm_dashboard import pm_dashboard
+from pm_dashboard.data_logger import DataLogger
+from pm_dashboard.database import Database
+from pm_dashboard.server import create_server
+from pm_dashboard.write_buffer import WriteBuffer
+
+BENCHMARKS = ['get_data', 'write_path', 'time_range', 'get_log', 'http', 'startup']
+RANGE_KEYS = 'cpu_percent,cpu_temperature,memory_percent,cpu_0_percent,disk_mmcblk0_percent,network_download_speed'
+RANGE_SPANS = {'1h': 3600, '24h': 86400, '30d': 30 * 86400}
+
+def summarize(durations):
+    # Milliseconds
+    return {
+        "iterations": len(durations),
+        "mean_ms": round(sum(durations) / len(durations) * 1000, 4),
+        "p50_ms": round(percentile(durations, 50) * 1000, 4),
+        "p99_ms": round(percentile(durations, 99) * 1000, 4),
+        "max_ms": round(max(durations) * 1000, 4),
+    }
+
+def measure(func, iterations, setup=None):
+    durations = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return summarize(durations)
+
+def create_database(stub):
+    # Database against the stub, treated as up without probing the
+    # influxd process the stub doesn't have
+    db = Database('pm_dashboard_bench', host=stub.host, port=stub.port)
+    db.client.switch_database('pm_dashboard_bench')
+    db.READY_TTL = float('inf')
+    db._set_state(Database.STATE_READY)
+    db.schema_cutover = time.time_ns() - 365 * 86400 * 1000000000
+    return db
+
+def bench_get_data(args, context):
+    data_logger = context['data_logger']
+    iterations = 200 if args.quick else 2000
+    data_logger.get_data()
+    return {
+        # Fast collectors only, slow ones are still cached
+        "steady": measure(data_logger.get_data, iterations),
+        # Every collector due, like the first sample after start
+        "all_collectors": measure(data_logger.get_data, iterations // 10, data_logger.refresh_collectors),
+        "fields": len(data_logger.get_data()),
+    }
+
+def bench_write_path(args, context):
+    db = context['db']
+    data_logger = context['data_logger']
+    iterations = 50 if args.quick else 500
+    sample = data_logger.get_data()
+    batch = [{"measurement": "history", "time": time.time_ns() + i, "fields": sample} for i in range(WriteBuffer.FLUSH_SIZE)]
+    write_buffer = WriteBuffer(db, flush_size=10 ** 9, flush_age=10 ** 9, max_size=10 ** 9)
+    results = {
+        "set": measure(lambda: db.set('history', sample), iterations),
+        f"write_points_{len(batch)}": measure(lambda: db.write_points(batch), iterations // 5),
+        "buffer_push": measure(lambda: write_buffer.push('history', sample, time.time_ns()), iterations * 10),
+    }
+    results["stub"] = context['stub'].stats()
+    return results
+
+def bench_time_range(args, context):
+    db = context['db']
+    iterations = 10 if args.quick else 50
+    results = {}
+    for name, span in RANGE_SPANS.items():
+        end = time.time_ns()
+        start = end - span * 1000000000
+        query = lambda: db.get_data_by_time_range('history', start, end, RANGE_KEYS)
+        results[name] = {
+            "cold": measure(query, iterations, db.invalidate_cache),
+            "cached": measure(query, iterations),
+            "points": len(query()),
+        }
+    return results
+
+def write_log(file_path, size):
+    lines = []
+    for i in range(10000):
+        level = 'ERROR' if i % 50 == 0 else 'DEBUG' if i % 3 == 0 else 'INFO'
+        lines.append(f'2024-01-01 12:{i // 60 % 60:02d}:{i % 60:02d} [{level}] pm_dashboard.data_logger: sample {i} written\n')
+    block = ''.join(lines).encode()
+    with open(file_path, 'wb') as f:
+        written = 0
+        while written < size:
+            f.write(block)
+            written += len(block)
+
+def bench_get_log(args, context):
+    sizes = [10] if args.quick else [int(size) for size in args.log_sizes.split(',')]
+    results = {}
+    with tempfile.TemporaryDirectory() as log_path:
+        pm_dashboard.__log_path__ = log_path
+        for size in sizes:
+            name = f'bench_{size}mb.log'
+            write_log(path.join(log_path, name), size * 1024 * 1024)
+            iterations = 20 if size < 1000 else 5
+            results[f'{size}MB'] = {
+                "last_100": measure(lambda: pm_dashboard._get_log(name, 100), iterations),
+                "last_100_error": measure(lambda: pm_dashboard._get_log(name, 100, level='ERROR'), iterations),
+                # Filter that never matches, scans the whole file
+                "no_match": measure(lambda: pm_dashboard._get_log(name, 100, filter=['no such line']), 1 if size >= 100 else 3),
+            }
+    return results
+
+def bench_http(args, context):
+    pm_dashboard.__data_logger__ = context['data_logger']
+    pm_dashboard.__db__ = context['db']
+    pm_dashboard.__enable_history__ = True
+    server = create_server('127.0.0.1', 0, pm_dashboard.__app__, mode=args.server_mode)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f'http://127.0.0.1:{server.port}{pm_dashboard.__api_prefix__}'
+    end = time.time_ns()
+    routes = {
+        "get-data": f'{base}/get-data',
+        "get-history": f'{base}/get-history',
+        "get-time-range_1h": f'{base}/get-time-range?start={end - 3600 * 1000000000}&end={end}&key={RANGE_KEYS}',
+    }
+    duration = 2 if args.quick else args.duration
+    results = {"server_mode": args.server_mode, "clients": args.clients}
+    try:
+        for name, url in routes.items():
+            deadline = time.monotonic() + duration
+            latencies = []
+            errors = []
+            threads = [threading.Thread(target=poller, args=(url, deadline, latencies, errors)) for _ in range(args.clients)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            result = summarize(latencies) if len(latencies) > 0 else {"iterations": 0}
+            result["requests_per_second"] = round(len(latencies) / duration, 1)
+            result["errors"] = len(errors)
+            results[name] = result
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+def bench_startup(args, context):
+    runs = 3 if args.quick else 10
+    return {
+        "history_disabled": startup.measure(runs, history=False),
+        "history_enabled": startup.measure(runs, history=True),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--quick', action='store_true')
+    parser.add_argument('--only', default=','.join(BENCHMARKS))
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--row-latency', type=float, default=0.00001)
+    parser.add_argument('--log-sizes', default='10,100,1000')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--server-mode', default='pool')
+    args = parser.parse_args()
+
+    stub = InfluxDBStub(latency=args.latency, row_latency=args.row_latency)
+    stub.start()
+    data_logger = DataLogger(database='pm_dashboard_bench', spc_enabled=True)
+    db = create_database(stub)
+    data_logger.db = db
+    data_logger.write_buffer = WriteBuffer(db)
+    context = {"stub": stub, "db": db, "data_logger": data_logger}
+
+    report = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "time": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "config": vars(args),
+        "results": {},
+    }
+    for name in args.only.split(','):
+        if name not in BENCHMARKS:
+            parser.error(f"Unknown benchmark: {name}, choose from {BENCHMARKS}")
+        print(f"Running {name}...", flush=True)
+        report["results"][name] = globals()[f'bench_{name}'](args, context)
+    stub.stop()
+
+    output = args.output
+    if output is None:
+        results_path = path.join(path.dirname(path.abspath(__file__)), 'results')
+        makedirs(results_path, exist_ok=True)
+        output = path.join(results_path, f'{__version__}-{time.strftime("%Y%m%d-%H%M%S")}.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["results"], indent=2))
+    print(f"Results written to {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+import logging
+import math
+import operator
+import re
+import threading
+import time
+from collections import deque
+from fnmatch import fnmatchcase
+
+# Measurement fired and resolved alerts are written to
+ALERTS_MEASUREMENT = 'alerts'
+
+# <metric> <op> <threshold> [for <duration>], or with a window function:
+# ewma(<metric>, <duration or N>), min(<metric>, N), max(<metric>, N)
+RULE = re.compile(r'''^\s*
+    (?: (?P<function>ewma|min|max) \(\s* (?P<window_metric>[\w*?\[\]]+) \s*,\s* (?P<window>[\d.]+\s*[smh]?) \s*\)
+      | (?P<metric>[\w*?\[\]]+) )
+    \s* (?P<op>>=|<=|==|!=|>|<) \s* (?P<threshold>-?[\d.]+)
+    (?: \s+for\s+ (?P<for>[\d.]+\s*[smh]?) )?
+    \s*$''', re.VERBOSE)
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600}
+
+def parse_duration(value):
+    # '30s', '5m', '1h' or plain seconds
+    value = str(value).strip()
+    if value[-1] in DURATION_UNITS:
+        return float(value[:-1]) * DURATION_UNITS[value[-1]]
+    return float(value)
+
+class EWMA:
+    def __init__(self, window):
+        # window: time constant like '30s', or a sample count
+        window = str(window).strip()
+        self.tau = parse_duration(window) if window[-1] in DURATION_UNITS else None
+        self.alpha = None if self.tau is not None else 2 / (int(window) + 1)
+        self.value = None
+        self.last_time = None
+
+    def update(self, value, now):
+        if self.value is None:
+            self.value = value
+        else:
+            alpha = self.alpha
+            if alpha is None:
+                alpha = 1 - math.exp(-max(now - self.last_time, 0) / self.tau)
+            self.value += alpha * (value - self.value)
+        self.last_time = now
+        return self.value
+
+class WindowExtreme:
+    # Min or max of the last N samples, monotonic deque so each update is
+    # amortized O(1) and memory is at most N
+    def __init__(self, window, function):
+        self.size = int(window)
+        self.better = operator.le if function == 'min' else operator.ge
+        self.values = deque()
+        self.count = 0
+
+    def update(self, value, now):
+        while len(self.values) > 0 and self.better(value, self.values[-1][1]):
+            self.values.pop()
+        self.values.append((self.count, value))
+        if self.values[0][0] <= self.count - self.size:
+            self.values.popleft()
+        self.count += 1
+        return self.values[0][1]
+
+class Rule:
+    SEVERITIES = ['info', 'warning', 'critical']
+
+    def __init__(self, expr, name=None, severity='warning', clear_for=0):
+        match = RULE.match(expr)
+        if match is None:
+            raise ValueError(f"Invalid alert rule: {expr}")
+        if severity not in self.SEVERITIES:
+            raise ValueError(f"Invalid severity: {severity}, choose from {self.SEVERITIES}")
+        self.expr = expr.strip()
+        self.name = name or self.expr
+        self.severity = severity
+        self.function = match.group('function')
+        self.window = match.group('window')
+        self.metric = match.group('window_metric') or match.group('metric')
+        self.op = match.group('op')
+        self.compare = OPERATORS[self.op]
+        self.threshold = float(match.group('threshold'))
+        self.duration = parse_duration(match.group('for')) if match.group('for') else 0.0
+        self.clear_for = parse_duration(clear_for)
+        self.wildcard = any(c in self.metric for c in '*?[')
+        # Fail on a bad window now rather than on the first sample
+        try:
+            self.create_window()
+        except ValueError:
+            raise ValueError(f"Invalid window for {self.function}: {self.window}")
+
+    def matches(self, field):
+        if self.wildcard:
+            return fnmatchcase(field, self.metric)
+        return field == self.metric
+
+    def create_window(self):
+        if self.function == 'ewma':
+            return EWMA(self.window)
+        if self.function in ['min', 'max']:
+            return WindowExtreme(self.window, self.function)
+        return None
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "expr": self.expr,
+            "severity": self.severity,
+            "for": self.duration,
+            "clear_for": self.clear_for,
+        }
+
+class AlertState:
+    # One rule applied to one field
+    def __init__(self, rule, field):
+        self.rule = rule
+        self.field = field
+        self.window = rule.create_window()
+        self.value = None
+        self.pending_since = None
+        self.clearing_since = None
+        self.firing = False
+        self.fired_at = None
+
+    def update(self, value, now):
+        # Returns 'firing' or 'resolved' when the state changes
+        if self.window is not None:
+            value = self.window.update(value, now)
+        self.value = value
+        if self.rule.compare(value, self.rule.threshold):
+            self.clearing_since = None
+            if self.firing:
+                return None
+            if self.pending_since is None:
+                self.pending_since = now
+            if now - self.pending_since >= self.rule.duration:
+                self.firing = True
+                self.fired_at = now
+                return 'firing'
+        else:
+            self.pending_since = None
+            if not self.firing:
+                return None
+            if self.clearing_since is None:
+                self.clearing_since = now
+            if now - self.clearing_since >= self.rule.clear_for:
+                self.firing = False
+                self.clearing_since = None
+                return 'resolved'
+        return None
+
+    def to_dict(self):
+        return {
+            "rule": self.rule.name,
+            "metric": self.field,
+            "severity": self.rule.severity,
+            "value": self.value,
+            "threshold": self.rule.threshold,
+            "since": self.fired_at,
+        }
+
+class AlertEngine:
+    # Recent alert events kept in memory, history keeps all of them
+    MAX_EVENTS = 200
+
+    def __init__(self, record=None, get_logger=None):
+        # record(measurement, fields, timestamp) stores fired and resolved alerts
+        if get_logger is None:
+            get_logger = logging.getLogger
+        self.log = get_logger(__name__)
+        self.record = record
+        self.rules = []
+        self.lock = threading.Lock()
+        # field -> [AlertState], built the first time a field is seen
+        self.index = {}
+        self.events = deque(maxlen=self.MAX_EVENTS)
+
+    def add_rule(self, rule):
+        # rule: expression string or {"expr": ..., "name": ..., "severity": ..., "clear_for": ...}
+        if isinstance(rule, str):
+            rule = Rule(rule)
+        else:
+            rule = Rule(**rule)
+        with self.lock:
+            self.rules.append(rule)
+            self._reindex([])
+        return rule
+
+    def remove_rule(self, name):
+        # Alerts of the removed rules that are firing resolve now
+        with self.lock:
+            removed = [rule for rule in self.rules if rule.name == name]
+            self.rules = [rule for rule in self.rules if rule.name != name]
+            resolved = self._reindex(removed)
+        timestamp = time.time_ns()
+        for alert in resolved:
+            self._emit(timestamp, 'resolved', alert)
+
+    def _reindex(self, removed):
+        # Called with the lock held. Fields already seen keep the states of
+        # rules still in place, so firing alerts stay firing, and get
+        # states for new rules. Returns the firing alerts of removed rules.
+        resolved = []
+        index = {}
+        for field, states in self.index.items():
+            kept = []
+            for state in states:
+                if state.rule not in removed:
+                    kept.append(state)
+                elif state.firing:
+                    resolved.append(state.to_dict())
+            rules = [state.rule for state in kept]
+            kept.extend(AlertState(rule, field) for rule in self.rules if rule not in rules and rule.matches(field))
+            index[field] = kept
+        self.index = index
+        return resolved
+
+    def _states(self, field):
+        states = self.index.get(field)
+        if states is None:
+            states = [AlertState(rule, field) for rule in self.rules if rule.matches(field)]
+            self.index[field] = states
+        return states
+
+    def publish(self, timestamp, data):
+        # DataLogger listener, only rules indexed under a field are checked
+        now = timestamp / 1e9
+        changes = []
+        with self.lock:
+            for field, value in data.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                for state in self._states(field):
+                    change = state.update(value, now)
+                    if change is not None:
+                        changes.append((change, state.to_dict()))
+        for change, alert in changes:
+            self._emit(timestamp, change, alert)
+
+    def _emit(self, timestamp, change, alert):
+        event = {"time": timestamp // 1000000, "state": change, **alert}
+        self.events.append(event)
+        level = logging.INFO if change == 'resolved' else logging.WARNING
+        self.log.log(level, f"Alert {change}: {alert['rule']} on {alert['metric']} = {alert['value']}")
+        if self.record is not None:
+            fields = {
+                "rule": alert['rule'],
+                "metric": alert['metric'],
+                "severity": alert['severity'],
+                "state": change,
+                "value": float(alert['value']),
+                "threshold": alert['threshold'],
+            }
+            self.record(ALERTS_MEASUREMENT, fields, timestamp)
+
+    def get_active(self):
+        with self.lock:
+            return [state.to_dict() for states in self.index.values() for state in states if state.firing]
+
+    def get_events(self, n=None):
+        events = list(self.events)
+        if n is not None:
+            events = events[-n:]
+        return events
+
+    def get_rules(self):
+        with self.lock:
+            return [rule.to_dict() for rule in self.rules]
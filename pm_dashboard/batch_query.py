@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from .storage import output_columns, parse_functions, to_columnar
+
+FORMATS = ['points', 'columnar']
+
+def select_columns(columns, rows, wanted, names):
+    # wanted columns out of a wider (columns, rows) result, renamed to
+    # names, missing ones as nulls
+    index = {column: i for i, column in enumerate(columns)}
+    picks = [index.get(column) for column in wanted]
+    return ["time"] + names, [[row[0]] + [None if i is None else row[i] for i in picks] for row in rows]
+
+class BatchQuery:
+    # Queries run at the same time, InfluxDB serves them in parallel
+    MAX_WORKERS = 4
+    # Specs accepted per batch
+    MAX_QUERIES = 32
+    # Largest max_size a spec can ask for
+    MAX_SIZE = 10000
+
+    def __init__(self, max_workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or self.MAX_WORKERS, thread_name_prefix='batch_query')
+
+    def parse(self, spec):
+        # Checked copy of one spec, raises ValueError
+        if not isinstance(spec, dict):
+            raise ValueError("Query must be an object")
+        if spec.get("start") is None or spec.get("end") is None:
+            raise ValueError("start and end are required")
+        keys = spec.get("key", "*")
+        if isinstance(keys, list):
+            keys = ",".join(keys)
+        functions = spec.get("function", "mean")
+        single = isinstance(functions, str)
+        if single:
+            functions = [functions]
+        # Every function of the spec is answered by one query
+        names = {function: parse_functions(function) for function in functions}
+        combined = ",".join(functions)
+        format = spec.get("format", "points")
+        if format not in FORMATS:
+            raise ValueError(f"format {format} not found, available formats: {', '.join(FORMATS)}")
+        max_size = int(spec.get("max_size", 300))
+        if max_size < 1 or max_size > self.MAX_SIZE:
+            raise ValueError(f"max_size must be between 1 and {self.MAX_SIZE}")
+        precision = spec.get("precision")
+        return {
+            "keys": keys,
+            "functions": functions,
+            "names": names,
+            "combined": combined,
+            "all": parse_functions(combined),
+            "single": single,
+            "start": int(spec["start"]),
+            "end": int(spec["end"]),
+            "max_size": max_size,
+            "format": format,
+            "delta": bool(spec.get("delta", False)),
+            "precision": None if precision is None else int(precision),
+        }
+
+    def run(self, db, measurement, specs):
+        # One result per spec, {"status": True, "data": ...} or
+        # {"status": False, "error": ...}. Specs sharing a window, function
+        # and max_size are answered by a single query over all their keys.
+        if len(specs) > self.MAX_QUERIES:
+            raise ValueError(f"Too many queries, at most {self.MAX_QUERIES}")
+        parsed = []
+        groups = {}
+        for spec in specs:
+            try:
+                spec = self.parse(spec)
+            except (ValueError, TypeError) as e:
+                parsed.append(e)
+                continue
+            parsed.append(spec)
+            group = (spec["start"], spec["end"], spec["combined"], spec["max_size"], spec["keys"] == "*")
+            keys = groups.setdefault(group, [])
+            if spec["keys"] != "*":
+                keys.extend(key for key in spec["keys"].split(",") if key not in keys)
+
+        futures = {}
+        for group, keys in groups.items():
+            start, end, function, max_size, all_keys = group
+            keys = "*" if all_keys else ",".join(keys)
+            futures[group] = self.executor.submit(db.get_rows_by_time_range, measurement, start, end, keys, function, max_size)
+
+        results = []
+        for spec in parsed:
+            if isinstance(spec, Exception):
+                results.append({"status": False, "error": str(spec)})
+                continue
+            try:
+                group = (spec["start"], spec["end"], spec["combined"], spec["max_size"], spec["keys"] == "*")
+                result_columns, result_rows = futures[group].result()
+                keys = spec["keys"]
+                if keys == "*":
+                    prefix = f'{spec["all"][0]}_' if len(spec["all"]) > 1 else ''
+                    keys = [column[len(prefix):] for column in result_columns[1:] if column.startswith(prefix)]
+                else:
+                    keys = keys.split(",")
+                data = {}
+                for function in spec["functions"]:
+                    names = spec["names"][function]
+                    wanted = output_columns(keys, spec["all"])[1:] if len(spec["all"]) == 1 else [f'{name}_{key}' for key in keys for name in names]
+                    columns, rows = select_columns(result_columns, result_rows, wanted, output_columns(keys, names)[1:])
+                    if spec["format"] == "columnar":
+                        data[function] = to_columnar(columns, rows, spec["delta"], spec["precision"])
+                    else:
+                        data[function] = db.rows_to_points(columns, rows)
+                results.append({"status": True, "data": data[spec["functions"][0]] if spec["single"] else data})
+            except Exception as e:
+                results.append({"status": False, "error": str(e)})
+        return results
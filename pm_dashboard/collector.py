@@ -0,0 +1,55 @@
+import time
+
+class Collector:
+    def __init__(self, name, func, interval=0, refresh_on=None):
+        # interval: seconds between samples, 0 to sample on every tick
+        # refresh_on: names of collectors whose changes trigger a resample
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.refresh_on = refresh_on or []
+        self.last_time = None
+        self.data = {}
+        # Seconds spent in func, for the sampler stats
+        self.duration = 0
+        self.max_duration = 0
+        self.total_duration = 0
+        self.count = 0
+        self.errors = 0
+
+    def is_due(self, now):
+        if self.last_time is None:
+            return True
+        return now - self.last_time >= self.interval
+
+    def invalidate(self):
+        self.last_time = None
+
+    def collect(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        start = time.monotonic()
+        try:
+            data = self.func()
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.duration = time.monotonic() - start
+            self.max_duration = max(self.max_duration, self.duration)
+            self.total_duration += self.duration
+            self.count += 1
+        changed = data != self.data
+        self.data = data
+        self.last_time = now
+        return changed
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "count": self.count,
+            "errors": self.errors,
+            "last": self.duration,
+            "mean": self.total_duration / self.count if self.count > 0 else None,
+            "max": self.max_duration,
+        }
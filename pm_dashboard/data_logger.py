@@ -2,9 +2,12 @@ import time
 import logging
 import threading
 
-from influxdb import InfluxDBClient
-
-from .database import Database
+from .collector import Collector
+from .dedup import Deduplicator
+from . import metrics
+from .scheduler import Scheduler
+from .storage import create_database
+from .write_buffer import WriteBuffer
 from .utils import log_error
 
 from sf_rpi_status import \
@@ -23,28 +26,53 @@ from sf_rpi_status import \
     get_network_speed, \
     PWMFan
 
+SAMPLE_SECONDS = metrics.histogram('pm_dashboard_sample_seconds', 'Time to take a sample, including listeners')
+COLLECTOR_SECONDS = metrics.histogram('pm_dashboard_collector_seconds', 'Time spent in a collector', ['collector'])
+
 class DataLogger:
+    # Collector intervals in seconds, fast moving values are sampled every tick
+    SLOW_INTERVAL = 10
+    STATIC_INTERVAL = 300
 
     @log_error
-    def __init__(self, database='pm_dashboard', interval=1, spc_enabled=False, get_logger=None):
+    def __init__(self, database='pm_dashboard', interval=1, spc_enabled=False, journal_path=None, flush_size=None, flush_age=None,
+                 database_backend='influxdb', database_path=None, overrun_policy='skip', dedup_fields=None, dedup_epsilon=None,
+                 keyframe=None, get_logger=None):
         if get_logger is None:
             get_logger = logging.getLogger
         self.log = get_logger(__name__)
-
-        try:
-            self.client = InfluxDBClient(host='localhost', port=8086)
-        except Exception as e:
-            self.log.error(f"Failed to connect to influxdb: {e}")
-            return
+        self.get_logger = get_logger
 
         self.spc = None
+        # Created on the first start(), a dashboard without history never
+        # builds or imports the database backend
         self.db = None
+        self.write_buffer = None
+        self.database = database
+        self.database_backend = database_backend
+        self.database_path = database_path
+        self.journal_path = journal_path
+        self.flush_size = flush_size
+        self.flush_age = flush_age
+        self.debug_level = None
 
         self.thread = None
         self.running = False
+        self.history_enabled = False
+
+        self.snapshot = None
+        self.snapshot_time = 0
+        self.snapshot_lock = threading.Lock()
+        # Collectors run on one thread at a time
+        self.data_lock = threading.Lock()
+
+        self.listeners = []
+
+        # Drops unchanged fields before they are written, reads fill them back in
+        self.dedup = Deduplicator(dedup_fields, dedup_epsilon, keyframe)
 
-        self.db = Database(database, get_logger=get_logger)
         self.interval = interval
+        self.scheduler = Scheduler(interval, overrun_policy)
         if spc_enabled:
             self.log.info("SPC peripheral enabled")
             from spc.spc import SPC
@@ -56,50 +84,114 @@ class DataLogger:
 
         self.status = {}
 
+        self.collectors = {}
+        self._add_default_collectors()
+
     @log_error
     def set_debug_level(self, level):
+        self.debug_level = level
+        if self.db is not None:
+            self.db.set_debug_level(level)
+            self.write_buffer.set_debug_level(level)
         self.log.setLevel(level)
 
+    def create_history(self):
+        # Database and write buffer, created once and reused across restarts
+        if self.db is not None:
+            return self.db
+        self.db = create_database(self.database, backend=self.database_backend, path=self.database_path, get_logger=self.get_logger)
+        self.write_buffer = WriteBuffer(self.db,
+            journal_path=self.journal_path,
+            flush_size=self.flush_size,
+            flush_age=self.flush_age,
+            get_logger=self.get_logger)
+        if self.dedup.enabled:
+            self.db.fill_window = self.dedup.keyframe
+            self.db.fill_seed = self.dedup.seed
+            self.db.fill_fields = self.dedup.deduplicated
+        if self.debug_level is not None:
+            self.db.set_debug_level(self.debug_level)
+            self.write_buffer.set_debug_level(self.debug_level)
+        return self.db
+
     @log_error
     def update_status(self, status):
         self.status = status
+        # Settings, only written when they change
+        self.dedup.add_fields(status)
 
     @log_error
     def set_interval(self, interval):
         self.interval = interval
+        self.scheduler.set_interval(interval)
 
     @log_error
-    def get_data(self):
-        boot_time = get_boot_time()
-        ips = get_ips()
-        macs = get_macs()
-        network_connection_type = get_network_connection_type()
-        network_speed = get_network_speed()
+    def set_overrun_policy(self, policy):
+        self.scheduler.set_policy(policy)
+
+    @log_error
+    def add_collector(self, name, func, interval=0, refresh_on=None):
+        self.collectors[name] = Collector(name, func, interval, refresh_on)
 
+    @log_error
+    def remove_collector(self, name):
+        self.collectors.pop(name, None)
+
+    @log_error
+    def refresh_collectors(self, names=None):
+        for name, collector in self.collectors.items():
+            if names is None or name in names:
+                collector.invalidate()
+
+    def _add_default_collectors(self):
+        self.add_collector('cpu', self._collect_cpu)
+        self.add_collector('memory', self._collect_memory)
+        self.add_collector('network_speed', self._collect_network_speed)
+        if self.pwm_fan._is_ready:
+            self.add_collector('pwm_fan', self._collect_pwm_fan)
+        if self.spc is not None:
+            self.add_collector('spc', self.spc.read_all)
+        self.add_collector('disks', self._collect_disks, self.SLOW_INTERVAL)
+        self.add_collector('network', self._collect_network, self.SLOW_INTERVAL)
+        self.add_collector('cpu_info', self._collect_cpu_info, self.STATIC_INTERVAL)
+        self.add_collector('boot_time', self._collect_boot_time, self.STATIC_INTERVAL)
+        self.add_collector('macs', self._collect_macs, self.STATIC_INTERVAL, refresh_on=['network'])
+
+    def _collect_cpu(self):
         data = {}
-        data['cpu_temperature'] = float(get_cpu_temperature()) if get_cpu_temperature() is not None else None
-        data['gpu_temperature'] = float(get_gpu_temperature()) if get_gpu_temperature() is not None else None
+        cpu_temperature = get_cpu_temperature()
+        gpu_temperature = get_gpu_temperature()
+        data['cpu_temperature'] = float(cpu_temperature) if cpu_temperature is not None else None
+        data['gpu_temperature'] = float(gpu_temperature) if gpu_temperature is not None else None
         data['cpu_percent'] = float(get_cpu_percent())
-        data['cpu_count'] = int(get_cpu_count())
-
-        if  self.pwm_fan._is_ready:
-            data['pwm_fan_speed'] = self.pwm_fan.get_speed()
+        data['cpu_freq'] = float(get_cpu_freq().current)
+        cpu_percents = get_cpu_percent(percpu=True)
+        for i, percent in enumerate(cpu_percents):
+            data[f'cpu_{i}_percent'] = float(percent)
+        return data
 
+    def _collect_cpu_info(self):
+        data = {}
         cpu_freq = get_cpu_freq()
-        data['cpu_freq'] = float(cpu_freq.current)
+        data['cpu_count'] = int(get_cpu_count())
         data['cpu_freq_min'] = float(cpu_freq.min)
         data['cpu_freq_max'] = float(cpu_freq.max)
+        return data
 
-        cpu_percents = get_cpu_percent(percpu=True)
-        for i, percent in enumerate(cpu_percents):
-            data[f'cpu_{i}_percent'] = float(percent)
+    def _collect_pwm_fan(self):
+        return {'pwm_fan_speed': self.pwm_fan.get_speed()}
 
+    def _collect_memory(self):
+        data = {}
         memory = get_memory_info()
         data['memory_total'] = int(memory.total)
         data['memory_available'] = int(memory.available)
         data['memory_percent'] = float(memory.percent)
         data['memory_used'] = int(memory.used)
+        return data
 
+    def _collect_disks(self):
+        data = {}
         disks = get_disks_info()
         for disk_name in disks:
             disk = disks[disk_name]
@@ -108,68 +200,178 @@ class DataLogger:
             data[f'disk_{disk_name}_used'] = int(disk.used)
             data[f'disk_{disk_name}_free'] = int(disk.free)
             data[f'disk_{disk_name}_percent'] = float(disk.percent)
+        return data
 
-        data['boot_time'] = float(boot_time)
+    def _collect_boot_time(self):
+        return {'boot_time': float(get_boot_time())}
 
+    def _collect_network(self):
+        data = {}
         ips = get_ips()
         for name in ips:
             data[f'ip_{name}'] = ips[name]
+        data['network_type'] = "&".join(get_network_connection_type())
+        return data
 
+    def _collect_macs(self):
+        data = {}
         macs = get_macs()
         for name in macs:
             data[f'mac_{name}'] = macs[name]
+        return data
 
-        data['network_type'] = "&".join(network_connection_type)
+    def _collect_network_speed(self):
+        data = {}
+        network_speed = get_network_speed()
         data['network_upload_speed'] = int(network_speed.upload)
         data['network_download_speed'] = int(network_speed.download)
+        return data
+
+    def collect(self):
+        now = time.monotonic()
+        for name, collector in list(self.collectors.items()):
+            if not collector.is_due(now):
+                continue
+            try:
+                changed = collector.collect(now)
+            except Exception as e:
+                # Keep serving the last good values of this collector
+                self.log.error(f"Collector {name} failed: {e}")
+                continue
+            finally:
+                COLLECTOR_SECONDS.observe(collector.duration, name)
+            if changed and collector.interval > 0:
+                self.log.debug(f"Collector {name} changed: {collector.data}")
+            if changed:
+                for other in self.collectors.values():
+                    if name in other.refresh_on:
+                        other.invalidate()
+
+    @log_error
+    def get_data(self):
+        self.collect()
+        data = {}
+        for collector in self.collectors.values():
+            data.update(collector.data)
 
         for name in self.status:
             data[name] = self.status[name]
 
-        if self.spc is not None:
-            spc = self.spc.read_all()
-            for key in spc:
-                data[key] = spc[key]
-
         for key in data:
             value = data[key]
             if isinstance(value, bool):
                 data[key] = int(value)
         return data
 
+    @log_error
+    def add_listener(self, func):
+        # func(timestamp, data) is called with every new sample, keep it fast
+        if func not in self.listeners:
+            self.listeners.append(func)
+
+    @log_error
+    def remove_listener(self, func):
+        if func in self.listeners:
+            self.listeners.remove(func)
+
+    @log_error
+    def get_snapshot(self):
+        # Latest sample taken by the sampler thread and its age in seconds
+        with self.snapshot_lock:
+            data = self.snapshot
+            snapshot_time = self.snapshot_time
+        if data is None:
+            # Nothing sampled yet, only happens right after start. Read the
+            # collectors without writing history or calling listeners, that
+            # is the sampler's job.
+            with self.data_lock:
+                data = self.get_data()
+            snapshot_time = time.monotonic()
+        return data, time.monotonic() - snapshot_time
+
+    def sample(self, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time_ns()
+        with self.data_lock:
+            data = self.get_data()
+        if data is None:
+            return None
+        with self.snapshot_lock:
+            self.snapshot = data
+            self.snapshot_time = time.monotonic()
+        if self.history_enabled:
+            for point_time, fields in self.dedup.filter(timestamp, data):
+                self.write_buffer.push('history', fields, point_time)
+            self.log.debug(f"Buffered data: {data}")
+        for listener in list(self.listeners):
+            try:
+                listener(timestamp, data)
+            except Exception as e:
+                self.log.error(f"Sample listener failed: {e}")
+        return data
+
+    @log_error
+    def record(self, measurement, fields, timestamp=None):
+        # Extra points stored along with history, e.g. alerts
+        if self.history_enabled:
+            self.write_buffer.push(measurement, fields, timestamp)
+
     @log_error
     def loop(self):
-        start = time.time()
+        self.scheduler.reset()
         while self.running:
-            data = self.get_data()
+            tick = self.scheduler.wait()
+            if tick is None:
+                break
+            with SAMPLE_SECONDS.time():
+                self.sample(self.scheduler.timestamp(tick))
+            self.scheduler.done(tick)
 
-            status, msg = self.db.set('history', data)
-            if not status:
-                self.log.error(f"Failed to set data: {msg}")
-            else:
-                self.log.debug(f"Set data: {data}")
+    @log_error
+    def get_sampler_stats(self):
+        stats = self.scheduler.stats()
+        stats['collectors'] = {name: collector.stats() for name, collector in list(self.collectors.items())}
+        stats['dedup'] = self.dedup.stats()
+        return stats
 
-            elapsed = time.time() - start
-            if elapsed < self.interval:
-                time.sleep(self.interval - elapsed)
-            start += self.interval
+    @log_error
+    def start_sampler(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+        self.log.info("Data Logger sampler start")
 
     @log_error
     def start(self):
-        if self.running:
+        if self.history_enabled:
             self.log.warning("Already running")
             return
+        if self.db is None:
+            self.create_history()
         self.db.start()
-        self.running = True
-        self.thread = threading.Thread(target=self.loop)
-        self.thread.start()
+        self.write_buffer.start()
+        # Start over with a full sample
+        self.dedup.reset()
+        self.history_enabled = True
+        self.start_sampler()
         self.log.info("Data Logger Start")
 
+    @log_error
+    def stop_history(self):
+        if self.history_enabled:
+            self.history_enabled = False
+            self.write_buffer.stop()
+            self.db.close()
+            self.log.info("Data Logger history stopped")
+
     @log_error
     def stop(self):
         self.log.debug("Stopping Data Logger")
+        self.stop_history()
         if self.running:
             self.running = False
+            self.scheduler.stop()
             self.thread.join()
-            self.db.close()
         self.log.info("Data Logger stopped")
@@ -2,41 +2,116 @@ from influxdb import InfluxDBClient
 from influxdb.exceptions import InfluxDBClientError
 import json
 import logging
+import socket
 import subprocess
+import threading
 import time
-from math import floor
+import zlib
+
+from .query_cache import QueryCache
+from . import metrics
+from . import schema
+from .storage import WRITE_SECONDS, QUERY_SECONDS, fill_points, is_exact, percentile_value, time_range_rows, to_columnar
+
+PROBE_SECONDS = metrics.histogram('pm_dashboard_db_probe_seconds', 'Time to probe InfluxDB readiness')
 
 class Database:
-    def __init__(self, database, get_logger=None):
+    # Seconds before an InfluxDB request is abandoned
+    REQUEST_TIMEOUT = 10
+    # Readiness states
+    STATE_UNKNOWN = 'unknown'
+    STATE_READY = 'ready'
+    STATE_UNHEALTHY = 'unhealthy'
+
+    # Seconds a successful probe is trusted before probing again
+    READY_TTL = 30
+    # Background re-probe backoff bounds in seconds, while unhealthy
+    PROBE_BACKOFF_MIN = 1
+    PROBE_BACKOFF_MAX = 30
+    # Seconds start() waits for InfluxDB, and its poll backoff bounds
+    START_TIMEOUT = 12
+    START_BACKOFF_MIN = 0.01
+    START_BACKOFF_MAX = 0.5
+
+    # Days raw samples are kept in the default retention policy
+    RAW_RETENTION_DAYS = 7
+    # Rollup tiers: (retention policy, resolution in seconds, retention in days, None for forever)
+    ROLLUP_TIERS = [
+        ('rollup_1m', 60, 90),
+        ('rollup_1h', 3600, None),
+    ]
+    # Aggregates stored per field in rollup tiers, as <function>_<field>
+    ROLLUP_FUNCTIONS = ['mean', 'min', 'max', 'sum', 'count']
+    # How a query function is computed from the stored rollup aggregates
+    ROLLUP_QUERY_FUNCTIONS = {
+        'mean': ('mean', 'mean'),
+        'min': ('min', 'min'),
+        'max': ('max', 'max'),
+        'sum': ('sum', 'sum'),
+        'count': ('sum', 'count'),
+        'last': ('last', 'mean'),
+        'percentile': ('percentile', 'mean'),
+    }
+    # Seconds of history backfilled into rollup tiers per query
+    BACKFILL_CHUNK = 86400
+    # Buckets older than this many seconds are complete and can be cached
+    CACHE_SETTLE_TIME = 10
+    # Retention policy for schema bookkeeping, kept forever
+    META_RETENTION_POLICY = 'meta'
+    # Seconds of raw history read per query by iter_points
+    EXPORT_CHUNK = 3600
+
+    def __init__(self, database, host='localhost', port=8086, get_logger=None):
         if get_logger is None:
             get_logger = logging.getLogger
         self.log = get_logger(__name__)
         self.database = database
         self.influx_manually_started = False
 
-        self.client = InfluxDBClient(host='localhost', port=8086)
+        self.host = host
+        self.port = port
+        self.client = InfluxDBClient(host=host, port=port, timeout=self.REQUEST_TIMEOUT)
+
+        self.state = self.STATE_UNKNOWN
+        self.state_time = 0
+        self.state_lock = threading.Lock()
+        self.probe_thread = None
+        self.closed = False
+
+        self.query_cache = QueryCache()
+
+        self.schema = schema.HistorySchema()
+        # Time (ns) history switched to the normalized schema, None to keep
+        # using the legacy flat measurement
+        self.schema_cutover = None
+        # Seconds a history field may go unwritten while unchanged, reads
+        # fill it back in for that long. None when every field is written.
+        self.fill_window = None
+        # Returns the last written values as [(time ns, fields)], so reads
+        # don't have to look for them in the database
+        self.fill_seed = None
+        # fill_fields(field) is True for fields written only on change,
+        # None to fill every field
+        self.fill_fields = None
+
+        self.default_retention_policy = 'autogen'
+        self.retention_thread = None
     
     def set_debug_level(self, level):
         self.log.info(f"Setting debug level to {level}")
         self.log.setLevel(level)
 
     def start(self):
+        self.closed = False
         if not Database.is_influxdb_running():
             self.log.info("Starting influxdb service")
             self.start_influxdb()
-            # Wait 2 seconds for InfluxDB to start
-            time.sleep(2)
 
         self.log.debug("Waiting for InfluxDB to be ready")
-        for _ in range(10):
-            if self.is_ready():
-                self.log.info("Influxdb is ready")
-                break
-            else:
-                time.sleep(1)
-        else:
+        if not self.wait_until_ready(self.START_TIMEOUT):
             self.log.error("Timeout waiting for InfluxDB to be ready")
             return False
+        self.log.info("Influxdb is ready")
 
         databases = self.client.get_list_database()
         if not any(db['name'] == self.database for db in databases):
@@ -44,8 +119,146 @@ class Database:
             self.log.info(f"Database '{self.database}' created successfully")
 
         self.client.switch_database(self.database)
+        try:
+            self.setup_retention()
+        except Exception as e:
+            # History still works without rollups, only slower
+            self.log.error(f"Failed to set up retention tiers: {e}")
+        try:
+            self.setup_schema()
+        except Exception as e:
+            self.log.error(f"Failed to set up normalized schema, using legacy '{schema.LEGACY_MEASUREMENT}' measurement: {e}")
+
+    def setup_schema(self):
+        # History written before the cutover stays in the legacy flat
+        # measurement until it expires, reads combine both
+        policies = self.client.get_list_retention_policies(self.database)
+        if not any(policy['name'] == self.META_RETENTION_POLICY for policy in policies):
+            self.client.create_retention_policy(self.META_RETENTION_POLICY, 'INF', 1, database=self.database)
+        result = self._query(f'SELECT * FROM "{self.META_RETENTION_POLICY}"."schema" ORDER BY time ASC LIMIT 1', epoch='ns')
+        points = list(result.get_points())
+        if len(points) > 0:
+            self.schema_cutover = points[0]['time']
+        else:
+            cutover = time.time_ns()
+            self.client.write_points([{"measurement": "schema", "time": cutover, "fields": {"version": 2}}],
+                time_precision='n', retention_policy=self.META_RETENTION_POLICY)
+            self.schema_cutover = cutover
+            self.log.info(f"History switched to normalized schema")
+
+    def setup_retention(self):
+        policies = self.client.get_list_retention_policies(self.database)
+        names = [policy['name'] for policy in policies]
+        default_duration = None
+        for policy in policies:
+            if policy['default']:
+                self.default_retention_policy = policy['name']
+                default_duration = policy['duration']
+
+        for name, resolution, days in self.ROLLUP_TIERS:
+            if name not in names:
+                duration = 'INF' if days is None else f'{days}d'
+                self.client.create_retention_policy(name, duration, 1, database=self.database)
+                self.log.info(f"Retention policy '{name}' created, duration {duration}")
+
+        queries = self._query('SHOW CONTINUOUS QUERIES')
+        existing = [cq['name'] for cq in queries.get_points(measurement=self.database)]
+        for name, resolution, days in self.ROLLUP_TIERS:
+            select = self._rollup_select(name, resolution)
+            # Each interval is computed again one interval later, so points
+            # the write buffer held past the boundary are rolled up too
+            definition = f'RESAMPLE EVERY {resolution}s FOR {2 * resolution}s BEGIN {select} GROUP BY time({resolution}s), * END'
+            # Named after its definition, a changed definition replaces the
+            # query instead of leaving the old one running
+            cq_name = f'cq_{name}_{zlib.crc32(definition.encode()):08x}'
+            for old in existing:
+                if old != cq_name and (old == f'cq_{name}' or old.startswith(f'cq_{name}_')):
+                    self._query(f'DROP CONTINUOUS QUERY "{old}" ON "{self.database}"', method='POST')
+                    self.log.info(f"Continuous query '{old}' dropped")
+            if cq_name in existing:
+                continue
+            self._query(f'CREATE CONTINUOUS QUERY "{cq_name}" ON "{self.database}" {definition}', method='POST')
+            self.log.info(f"Continuous query '{cq_name}' created")
+
+        # InfluxDB reports durations as hours, e.g. 168h0m0s
+        if default_duration != f'{self.RAW_RETENTION_DAYS * 24}h0m0s':
+            # Roll up existing raw history before it expires, then shorten it
+            self.retention_thread = threading.Thread(target=self._backfill_rollups, daemon=True)
+            self.retention_thread.start()
+
+    def _rollup_select(self, tier, resolution):
+        functions = ', '.join(f'{function}(*)' for function in self.ROLLUP_FUNCTIONS)
+        return f'SELECT {functions} INTO "{self.database}"."{tier}".:MEASUREMENT FROM "{self.database}"."{self.default_retention_policy}"./.*/'
+
+    def _backfill_rollups(self):
+        try:
+            result = self._query(f'SELECT * FROM "{self.default_retention_policy}"./.*/ ORDER BY time ASC LIMIT 1', epoch='s')
+            times = [point['time'] for point in result.get_points()]
+            if len(times) > 0:
+                self.rollup_range(min(times) * 1000000000, time.time_ns())
+                self.log.info(f"Backfilled retention policies {[tier for tier, _, _ in self.ROLLUP_TIERS]}")
+            if self.closed:
+                return
+            self.client.alter_retention_policy(self.default_retention_policy, database=self.database,
+                duration=f'{self.RAW_RETENTION_DAYS}d', default=True)
+            self.log.info(f"Retention policy '{self.default_retention_policy}' set to {self.RAW_RETENTION_DAYS}d")
+        except Exception as e:
+            self.log.error(f"Failed to backfill rollups: {e}")
+
+    def rollup_range(self, start_time, end_time):
+        # Rolls up raw points the continuous queries didn't see, like
+        # backfilled or imported history. Times in ns.
+        for tier, resolution, days in self.ROLLUP_TIERS:
+            select = self._rollup_select(tier, resolution)
+            start = int(start_time) // 1000000000 // resolution * resolution
+            end = int(end_time) // 1000000000 + 1
+            while start < end and not self.closed:
+                until = min(start + self.BACKFILL_CHUNK, -(-end // resolution) * resolution)
+                self._query(f'{select} WHERE time >= {start}s AND time < {until}s GROUP BY time({resolution}s), *', method='POST')
+                start = until
 
     def is_ready(self):
+        with self.state_lock:
+            state = self.state
+            age = time.monotonic() - self.state_time
+        if state == self.STATE_UNKNOWN:
+            return self.probe()
+        if state == self.STATE_UNHEALTHY:
+            self._start_background_probe()
+            return False
+        if age > self.READY_TTL:
+            # Serve the cached state and refresh it off the caller's thread
+            self._start_background_probe()
+        return True
+
+    def wait_until_ready(self, timeout):
+        # Polls the HTTP port with a short, growing backoff instead of
+        # fixed sleeps, so a running InfluxDB is picked up right away
+        deadline = time.monotonic() + timeout
+        backoff = self.START_BACKOFF_MIN
+        while not self.closed:
+            if self.is_port_open() and self.probe():
+                return True
+            if time.monotonic() + backoff > deadline:
+                return False
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.START_BACKOFF_MAX)
+        return False
+
+    def is_port_open(self):
+        try:
+            with socket.create_connection((self.host, self.port), timeout=self.START_BACKOFF_MAX):
+                return True
+        except OSError:
+            return False
+
+    def probe(self):
+        with PROBE_SECONDS.time():
+            ready = self._probe()
+        self._set_state(self.STATE_READY if ready else self.STATE_UNHEALTHY)
+        return ready
+
+    def _probe(self):
         ports = Database.get_influxdb_ports()
         if len(ports) == 0:
             self.log.error("Influxdb process error, no ports found")
@@ -53,10 +266,57 @@ class Database:
         if len(ports) == 1:
             self.log.info(f"Influxdb process error, only running on port {ports[0]}")
         try:
-            return self.client.ping()
+            self.client.ping()
+            return True
         except Exception as e:
             return False
 
+    def _set_state(self, state):
+        with self.state_lock:
+            if state != self.state:
+                self.log.info(f"InfluxDB state changed: {self.state} -> {state}")
+            self.state = state
+            self.state_time = time.monotonic()
+
+    def mark_unhealthy(self, reason):
+        self.log.warning(f"Marking InfluxDB unhealthy: {reason}")
+        self._set_state(self.STATE_UNHEALTHY)
+        self._start_background_probe()
+
+    def get_state(self):
+        with self.state_lock:
+            return {
+                "state": self.state,
+                "age": time.monotonic() - self.state_time,
+            }
+
+    def _start_background_probe(self):
+        with self.state_lock:
+            if self.closed:
+                return
+            if self.probe_thread is not None and self.probe_thread.is_alive():
+                return
+            self.probe_thread = threading.Thread(target=self._probe_loop, daemon=True)
+            self.probe_thread.start()
+
+    def _probe_loop(self):
+        backoff = self.PROBE_BACKOFF_MIN
+        while not self.closed:
+            if self.probe():
+                return
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.PROBE_BACKOFF_MAX)
+
+    def _query(self, query, **kwargs):
+        try:
+            with QUERY_SECONDS.time('influxdb'):
+                return self.client.query(query, **kwargs)
+        except InfluxDBClientError:
+            raise
+        except Exception as e:
+            self.mark_unhealthy(e)
+            raise
+
     @staticmethod
     def is_influxdb_running():
         try:
@@ -94,40 +354,233 @@ class Database:
         json_body = [
             {
                 "measurement": measurement,
+                "time": time.time_ns(),
                 "fields": data
             }
         ]
+        status, msg = self.write_points(json_body)
+        if not status:
+            return False, msg
+        return True, json_body
+
+    def write_points(self, points, history_schema=None):
+        # points: [{"measurement": str, "time": int (ns), "fields": dict}, ...]
+        # Sent as a single line protocol request. history_schema splits
+        # history points, the live writer's by default, imports bring their
+        # own so older points don't go through its inventory state
+        if not self.is_ready():
+            return False, 'Database is not ready'
+        if history_schema is None:
+            history_schema = self.schema
+        if self.schema_cutover is not None:
+            normalized = []
+            for point in points:
+                if point['measurement'] == schema.LEGACY_MEASUREMENT:
+                    normalized.extend(history_schema.split(point))
+                else:
+                    normalized.append(point)
+            points = normalized
         try:
-            self.client.write_points(json_body)
-            return True, json_body
+            with WRITE_SECONDS.time('influxdb'):
+                self.client.write_points(points, time_precision='n')
+            return True, None
         except InfluxDBClientError as e:
             return False, json.loads(e.content)["error"]
         except Exception as e:
+            self.mark_unhealthy(e)
+            # Inventory may not have been written, write it again next time
+            history_schema.inventory = None
             return False, str(e)
 
     def get_data_by_time_range(self, measurement, start_time, end_time, keys="*", function="mean", max_size=300):
-        # self.log.warning(f"Getting data from database: measurement={measurement}, keys={keys}, start_time={start_time}, end_time={end_time}, function={function}, max_size={max_size}")
+        columns, rows = self.get_rows_by_time_range(measurement, start_time, end_time, keys, function, max_size)
+        return self.rows_to_points(columns, rows)
+
+    @staticmethod
+    def rows_to_points(columns, rows):
+        return [dict(zip(columns, [Database.format_time(row[0])] + row[1:])) for row in rows]
+
+    def get_columns_by_time_range(self, measurement, start_time, end_time, keys="*", function="mean", max_size=300, time_delta=False, precision=None):
+        # Columnar variant: {"time": [...], "values": {key: [...]}} with
+        # times in epoch seconds, optionally as deltas from the previous one
+        columns, rows = self.get_rows_by_time_range(measurement, start_time, end_time, keys, function, max_size)
+        return to_columnar(columns, rows, time_delta, precision)
+
+    def get_rows_by_time_range(self, measurement, start_time, end_time, keys="*", function="mean", max_size=300):
+        # (columns, rows), columns[0] is "time" in epoch seconds
         if not self.is_ready():
             self.log.error('Database is not ready')
-            return []
-        if function not in ["mean", "sum", "min", "max", "count"]:
-            self.log.error(f"Invalid function: {function}")
-            return []
-        if keys != "*":
-            newKeys = []
-            for k in keys.split(","):
-                newKeys.append(f'{function}("{k}") as "{k}"')
-            keys = ",".join(newKeys)
-        duration = int(end_time) - int(start_time)
-        duration_in_seconds = duration / 1000000000
-        interval = 1
-        if duration_in_seconds > max_size:
-            interval = duration_in_seconds / max_size
-            interval = floor(interval)
-        query = f'SELECT {keys} FROM {measurement} WHERE time >= {start_time} AND time <= {end_time} GROUP BY time({interval}s)'
+            return [], []
+        try:
+            return time_range_rows(self, measurement, start_time, end_time, keys, function, max_size)
+        except ValueError as e:
+            self.log.error(str(e))
+            return [], []
+
+    def bucket_rows(self, measurement, start_time, end_time, keys, bases, interval):
+        # [time] + bases per key for each bucket. Complete buckets fully
+        # inside the range are served from the cache, only the partial head
+        # and the missing newest buckets are queried.
+        interval_ns = interval * 1000000000
+        keys = ",".join(keys)
+        bases = tuple(bases)
+        cache_start = -(-start_time // interval_ns) * interval_ns
+        cache_end = min((end_time + 1) // interval_ns, (time.time_ns() - self.CACHE_SETTLE_TIME * 1000000000) // interval_ns) * interval_ns
+        rows = []
+        fetch_start = start_time
+        if cache_end > cache_start:
+            if cache_start > start_time:
+                rows.extend(self._get_range(measurement, start_time, cache_start - 1, keys, bases, interval)[1])
+            fetch_start = cache_start
+            while fetch_start < cache_end:
+                row = self.query_cache.get((measurement, keys, bases, interval, fetch_start))
+                if row is None:
+                    break
+                rows.append(row)
+                fetch_start += interval_ns
+        fetched = self._get_range(measurement, fetch_start, end_time, keys, bases, interval)[1]
+        for row in fetched:
+            bucket = row[0] * 1000000000
+            if bucket < cache_start or bucket >= cache_end:
+                continue
+            self.query_cache.put((measurement, keys, bases, interval, bucket), row)
+        rows.extend(fetched)
+        return rows
+
+    def _get_range(self, measurement, start_time, end_time, keys, functions, interval):
+        tier, resolution = self._choose_tier(start_time, interval, any(is_exact(function) for function in functions))
+        if tier is None:
+            return self._query_range(measurement, None, start_time, end_time, keys, functions, interval)
+
+        # The newest part isn't rolled up yet, read it from raw data. Split
+        # on a bucket boundary so no bucket mixes both sources.
+        interval_ns = interval * 1000000000
+        rolled_up = (time.time_ns() - resolution * 1000000000) // interval_ns * interval_ns
+        rolled_up = max(min(rolled_up, end_time + 1), start_time)
+        columns = []
+        rows = []
+        if rolled_up > start_time:
+            columns, tier_rows = self._query_range(measurement, tier, start_time, rolled_up - 1, keys, functions, interval)
+            rows.extend(tier_rows)
+        if rolled_up <= end_time:
+            columns, raw_rows = self._query_range(measurement, None, rolled_up, end_time, keys, functions, interval)
+            rows.extend(raw_rows)
+        return columns, rows
+
+    @staticmethod
+    def format_time(value):
+        # Epoch seconds to the RFC3339 form InfluxDB returns by default
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(value))
+
+    def get_cache_stats(self):
+        return self.query_cache.stats()
+
+    def invalidate_cache(self):
+        self.query_cache.clear()
+
+    def _choose_tier(self, start_time, interval, exact=False):
+        # Coarsest tier that still gives the requested number of buckets,
+        # or the finest one that still holds data for start_time. exact
+        # skips tiers while raw data is still kept.
+        raw_start = time.time_ns() - self.RAW_RETENTION_DAYS * 86400 * 1000000000
+        chosen = (None, 1)
+        for name, resolution, days in self.ROLLUP_TIERS:
+            if (resolution <= interval and not exact) or start_time < raw_start:
+                chosen = (name, resolution)
+                if days is not None:
+                    raw_start = time.time_ns() - days * 86400 * 1000000000
+        return chosen
+
+    def _query_range(self, measurement, tier, start_time, end_time, keys, functions, interval):
+        if measurement != schema.LEGACY_MEASUREMENT or self.schema_cutover is None:
+            return self._query_measurement_range(measurement, tier, start_time, end_time, keys, functions, interval)
+        # Legacy data before the cutover, normalized after, split on a
+        # bucket boundary
+        interval_ns = interval * 1000000000
+        cutover = -(-self.schema_cutover // interval_ns) * interval_ns
+        if start_time >= cutover:
+            return self._query_normalized_range(tier, start_time, end_time, keys, functions, interval)
+        if end_time < cutover:
+            return self._query_measurement_range(measurement, tier, start_time, end_time, keys, functions, interval)
+        columns, rows = self._query_measurement_range(measurement, tier, start_time, cutover - 1, keys, functions, interval)
+        columns, normalized_rows = self._query_normalized_range(tier, cutover, end_time, keys, functions, interval)
+        return columns, rows + normalized_rows
+
+    def _select_field(self, tier, function, field, alias):
+        argument = ''
+        if function.startswith('percentile_'):
+            function, argument = 'percentile', f', {percentile_value(function)}'
+        if tier is None:
+            return f'{function}("{field}"{argument}) as "{alias}"'
+        query_function, stored_function = self.ROLLUP_QUERY_FUNCTIONS[function]
+        return f'{query_function}("{stored_function}_{field}"{argument}) as "{alias}"'
+
+    def _query_normalized_range(self, tier, start_time, end_time, keys, functions, interval):
+        # Columns are <function>_<key>, functions per key
+        keys = keys.split(",")
+        groups = {}
+        for key in keys:
+            measurement, tags, field = schema.locate(key)
+            groups.setdefault((measurement, tuple(tags.items())), []).append((field, key))
+
+        statements = []
+        for (measurement, tags), fields in groups.items():
+            select = ",".join(self._select_field(tier, function, field, f'{function}_{key}') for field, key in fields for function in functions)
+            source = measurement if tier is None else f'"{tier}"."{measurement}"'
+            where = f'time >= {start_time} AND time <= {end_time}'
+            fill = ''
+            if measurement == schema.INVENTORY_MEASUREMENT:
+                # Inventory is only written on change, look back one
+                # keyframe and carry the last value forward
+                where = f'time >= {start_time - schema.HistorySchema.INVENTORY_KEYFRAME * 1000000000} AND time <= {end_time}'
+                fill = ' fill(previous)'
+            for tag, value in tags:
+                where += f' AND "{tag}" = \'{value}\''
+            statements.append(f'SELECT {select} FROM {source} WHERE {where} GROUP BY time({interval}s){fill}')
+        results = self._query(";".join(statements), epoch='s')
+        if not isinstance(results, list):
+            results = [results]
+
+        columns = ["time"] + [f'{function}_{key}' for key in keys for function in functions]
+        index = {key: i for i, key in enumerate(columns)}
+        first_bucket = start_time // (interval * 1000000000) * interval
+        rows = {}
+        inventory = []
+        for ((measurement, tags), fields), result in zip(groups.items(), results):
+            for series in result.raw.get('series', []):
+                if measurement == schema.INVENTORY_MEASUREMENT:
+                    inventory.append(series)
+                    continue
+                for values in series['values']:
+                    row = rows.setdefault(values[0], [values[0]] + [None] * (len(columns) - 1))
+                    for column, value in zip(series['columns'][1:], values[1:]):
+                        row[index[column]] = value
+        for series in inventory:
+            for values in series['values']:
+                if values[0] < first_bucket:
+                    continue
+                if values[0] not in rows:
+                    if len(groups) > 1:
+                        continue
+                    rows[values[0]] = [values[0]] + [None] * (len(columns) - 1)
+                row = rows[values[0]]
+                for column, value in zip(series['columns'][1:], values[1:]):
+                    row[index[column]] = value
+        return columns, [rows[t] for t in sorted(rows)]
+
+    def _query_measurement_range(self, measurement, tier, start_time, end_time, keys, functions, interval):
+        select = ",".join(self._select_field(tier, function, k, f'{function}_{k}') for k in keys.split(",") for function in functions)
+        if tier is not None:
+            measurement = f'"{tier}"."{measurement}"'
+        query = f'SELECT {select} FROM {measurement} WHERE time >= {start_time} AND time <= {end_time} GROUP BY time({interval}s)'
         # self.log.warning(f"Query: {query}")
-        result = self.client.query(query)
-        return list(result.get_points())
+        result = self._query(query, epoch='s')
+        # Read InfluxDB's column oriented result directly, without building
+        # a dict per point
+        series = result.raw.get('series', [])
+        if len(series) == 0:
+            return [], []
+        return series[0]['columns'], series[0]['values']
 
     def if_too_many_nulls(self, result, threshold=0.3):
         for point in result:
@@ -142,16 +595,29 @@ class Database:
         if not self.is_ready():
             self.log.error('Database is not ready')
             return []
+        if measurement == schema.LEGACY_MEASUREMENT and self.schema_cutover is not None:
+            found, result = self._get_normalized(key, n)
+            if found:
+                result = self._fill_latest(measurement, key, result)
+                if n == 1:
+                    result = result[0]
+                    if key != "*" and key != "time" and "," not in key:
+                        result = result[key]
+                self.log.debug(f"Got data from database: {result}")
+                return result
+            # Nothing written since the cutover yet, fall back to legacy data
+        filled = measurement == schema.LEGACY_MEASUREMENT and self.fill_window is not None
         for _ in range(3):
             query = f"SELECT {key} FROM {measurement} ORDER BY time DESC LIMIT {n}"
-            result = self.client.query(query)
-            if self.if_too_many_nulls(list(result.get_points())):
+            result = self._query(query)
+            # Fields written only on change are null most of the time
+            if not filled and self.if_too_many_nulls(list(result.get_points())):
                 self.log.warning(f"Too many nulls in the result of query: {query}, result: {list(result.get_points())}. trying again...")
                 continue
             break
         else:
             return None
-        result = list(result.get_points())
+        result = self._fill_latest(measurement, key, list(result.get_points()))
         if n == 1:
             if len(result) == 0:
                 self.log.warning(f"No data found for query: {query}")
@@ -163,18 +629,166 @@ class Database:
         self.log.debug(f"Got data from database: {result}")
         return result
 
+    def _get_normalized(self, key, n):
+        # Latest n samples merged back into flat history points
+        statements = [
+            f'SELECT * FROM {schema.SYSTEM_MEASUREMENT} ORDER BY time DESC LIMIT {n}',
+            f'SELECT * FROM {schema.CPU_MEASUREMENT} GROUP BY "core" ORDER BY time DESC LIMIT {n}',
+            f'SELECT * FROM {schema.DISK_MEASUREMENT} GROUP BY "disk" ORDER BY time DESC LIMIT {n}',
+            f'SELECT * FROM {schema.INVENTORY_MEASUREMENT} ORDER BY time DESC LIMIT 1',
+        ]
+        results = self._query(";".join(statements))
+        system, cpu, disk, inventory = results
+        points = {}
+        for point in system.get_points():
+            points[point['time']] = point
+        if len(points) == 0:
+            return False, None
+        for result, measurement in [(cpu, schema.CPU_MEASUREMENT), (disk, schema.DISK_MEASUREMENT)]:
+            for (_, tags), series in result.items():
+                for point in series:
+                    if point['time'] not in points:
+                        continue
+                    for field, value in point.items():
+                        if field == 'time' or field in tags:
+                            continue
+                        points[point['time']][schema.flat_key(measurement, tags, field)] = value
+        latest_inventory = next(inventory.get_points(), {})
+        result = []
+        for t in sorted(points, reverse=True):
+            point = points[t]
+            for field, value in latest_inventory.items():
+                if field != 'time':
+                    point[field] = value
+            if key != "*":
+                keys = key.split(",")
+                point = {k: point.get(k) for k in ["time"] + keys}
+            result.append(point)
+        return True, result
+
+    def _fill_latest(self, measurement, key, points):
+        # Fields written only on change filled back into the latest points,
+        # from earlier points and the last written values
+        if measurement != schema.LEGACY_MEASUREMENT or self.fill_window is None or len(points) == 0:
+            return points
+        seed = [] if self.fill_seed is None else self.fill_seed()
+        return fill_points(points, seed, None if key == "*" else key.split(","), self.fill_window * 1000000000, self.fill_fields)
+
+    def field_keys(self, measurement, numeric=False):
+        # Every field ever written to measurement, sorted, numeric ones only
+        # with numeric. History after the cutover is read from the
+        # normalized measurements and their tags.
+        numeric_types = ['float', 'integer']
+        if measurement != schema.LEGACY_MEASUREMENT or self.schema_cutover is None:
+            result = self._query(f'SHOW FIELD KEYS FROM "{measurement}"')
+            return sorted(point['fieldKey'] for point in result.get_points() if not numeric or point['fieldType'] in numeric_types)
+        statements = [f'SHOW FIELD KEYS FROM "{name}"' for name in [measurement] + schema.MEASUREMENTS] + [
+            f'SHOW TAG VALUES FROM {schema.CPU_MEASUREMENT} WITH KEY = "core"',
+            f'SHOW TAG VALUES FROM {schema.DISK_MEASUREMENT} WITH KEY = "disk"',
+        ]
+        results = self._query(";".join(statements))
+        legacy, system, cpu, disk, inventory, cores, disks = results
+        tags = {
+            schema.CPU_MEASUREMENT: [{"core": point['value']} for point in cores.get_points()],
+            schema.DISK_MEASUREMENT: [{"disk": point['value']} for point in disks.get_points()],
+        }
+        keys = set()
+        for result, name in [(legacy, None), (system, schema.SYSTEM_MEASUREMENT), (cpu, schema.CPU_MEASUREMENT), (disk, schema.DISK_MEASUREMENT), (inventory, schema.INVENTORY_MEASUREMENT)]:
+            for point in result.get_points():
+                if numeric and point['fieldType'] not in numeric_types:
+                    continue
+                if name in tags:
+                    keys.update(schema.flat_key(name, series_tags, point['fieldKey']) for series_tags in tags[name])
+                else:
+                    keys.add(point['fieldKey'])
+        return sorted(keys)
+
+    def iter_points(self, measurement, start_time, end_time, keys="*"):
+        # Raw points as (time ns, fields) in time order, read one chunk at a
+        # time so memory doesn't grow with the range
+        if not self.is_ready():
+            raise ConnectionError('Database is not ready')
+        keys = None if keys == "*" else keys.split(",")
+        start_time = int(start_time)
+        end_time = int(end_time)
+        chunk = self.EXPORT_CHUNK * 1000000000
+        while start_time <= end_time:
+            until = min(start_time + chunk, end_time + 1)
+            if measurement == schema.LEGACY_MEASUREMENT and self.schema_cutover is not None and until > self.schema_cutover:
+                cutover = max(self.schema_cutover, start_time)
+                points = []
+                if cutover > start_time:
+                    points.extend(self._read_measurement(measurement, start_time, cutover))
+                points.extend(self._read_normalized(cutover, until))
+            else:
+                points = self._read_measurement(measurement, start_time, until)
+            for timestamp, fields in points:
+                if keys is not None:
+                    fields = {key: fields[key] for key in keys if fields.get(key) is not None}
+                if len(fields) > 0:
+                    yield timestamp, fields
+            start_time = until
+
+    def _read_measurement(self, measurement, start_time, end_time):
+        result = self._query(f'SELECT * FROM "{measurement}" WHERE time >= {start_time} AND time < {end_time}', epoch='ns')
+        points = []
+        for point in result.get_points():
+            timestamp = point.pop('time')
+            points.append((timestamp, {key: value for key, value in point.items() if value is not None}))
+        return points
+
+    def _read_normalized(self, start_time, end_time):
+        # Normalized points merged back into flat history points
+        where = f'time >= {start_time} AND time < {end_time}'
+        statements = [
+            f'SELECT * FROM {schema.SYSTEM_MEASUREMENT} WHERE {where}',
+            f'SELECT * FROM {schema.CPU_MEASUREMENT} WHERE {where} GROUP BY "core"',
+            f'SELECT * FROM {schema.DISK_MEASUREMENT} WHERE {where} GROUP BY "disk"',
+            f'SELECT * FROM {schema.INVENTORY_MEASUREMENT} WHERE {where}',
+        ]
+        results = self._query(";".join(statements), epoch='ns')
+        points = {}
+        for result, measurement in zip(results, [schema.SYSTEM_MEASUREMENT, schema.CPU_MEASUREMENT, schema.DISK_MEASUREMENT, schema.INVENTORY_MEASUREMENT]):
+            for (_, tags), series in result.items():
+                tags = tags or {}
+                for point in series:
+                    fields = points.setdefault(point['time'], {})
+                    for field, value in point.items():
+                        if field == 'time' or field in tags or value is None:
+                            continue
+                        fields[schema.flat_key(measurement, tags, field)] = value
+        return [(t, points[t]) for t in sorted(points)]
+
     def clear_measurement(self, measurement):
         self.log.warning(f"Clearing database: {self.database}")
         if not self.is_ready():
             self.log.error('Database is not ready')
             return False
-        self.client.drop_measurement(measurement)
+        names = [measurement]
+        if measurement == schema.LEGACY_MEASUREMENT:
+            # Legacy data and its normalized replacement, either may not exist
+            names.extend(schema.MEASUREMENTS)
+        try:
+            for name in names:
+                try:
+                    self.client.drop_measurement(name)
+                except InfluxDBClientError:
+                    if len(names) == 1:
+                        raise
+        except InfluxDBClientError:
+            raise
+        except Exception as e:
+            self.mark_unhealthy(e)
+            raise
+        self.query_cache.clear()
         self.log.info(f"Database '{self.database}' cleared successfully")
         return True
 
     def close(self):
+        self.closed = True
+        if self.retention_thread is not None:
+            self.retention_thread.join(timeout=self.REQUEST_TIMEOUT)
         self.client.close()
         if self.influx_manually_started:
             self.stop_influxdb()
         self.log.info("Database closed")
-
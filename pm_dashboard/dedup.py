@@ -0,0 +1,124 @@
+from fnmatch import fnmatchcase
+
+# Fields that describe the device or its settings and rarely change,
+# written only on change by default
+DEDUP_FIELDS = [
+    'cpu_count', 'cpu_freq_min', 'cpu_freq_max', 'memory_total', 'boot_time',
+    'disk_*_total', 'disk_*_mounted',
+    'ip_*', 'mac_*', 'network_type',
+    'fan_power', 'is_*',
+]
+
+class Deduplicator:
+    # Seconds between full samples. Reads carry a value forward at most
+    # this long, so real gaps in the data stay gaps.
+    KEYFRAME = 300
+
+    def __init__(self, fields=None, epsilon=None, keyframe=None):
+        # fields: glob patterns of fields written only on change, ['*'] for all
+        # epsilon: {pattern: tolerance}, numbers within tolerance of the last
+        # written value count as unchanged. Matching fields are deduplicated
+        # even if not in fields.
+        self.fields = list(DEDUP_FIELDS if fields is None else fields)
+        self.epsilon = dict(epsilon or {})
+        self.keyframe = keyframe or self.KEYFRAME
+        # field -> (deduplicated, tolerance)
+        self.rules = {}
+        self.written = 0
+        self.dropped = 0
+        self.reset()
+
+    @property
+    def enabled(self):
+        return len(self.fields) > 0 or len(self.epsilon) > 0
+
+    def reset(self):
+        # Next sample is a keyframe
+        self.last = {}
+        # field -> time ns it was last written
+        self.last_time = {}
+        self.held = {}
+        self.previous_time = None
+        self.keyframe_time = None
+
+    def add_fields(self, patterns):
+        for pattern in patterns:
+            if pattern not in self.fields:
+                self.fields.append(pattern)
+                self.rules.clear()
+
+    def _rule(self, field):
+        rule = self.rules.get(field)
+        if rule is None:
+            tolerance = next((value for pattern, value in self.epsilon.items() if fnmatchcase(field, pattern)), None)
+            deduplicated = tolerance is not None or any(fnmatchcase(field, pattern) for pattern in self.fields)
+            rule = (deduplicated, tolerance or 0)
+            self.rules[field] = rule
+        return rule
+
+    def deduplicated(self, field):
+        # Whether field is written only on change
+        return self._rule(field)[0]
+
+    @staticmethod
+    def _same(last, value, tolerance):
+        if tolerance > 0 and isinstance(value, (int, float)) and isinstance(last, (int, float)) \
+                and not isinstance(value, bool) and not isinstance(last, bool):
+            return abs(value - last) <= tolerance
+        return last == value
+
+    def filter(self, timestamp, data):
+        # Points to write for a sample: [(time ns, fields)]. When a held
+        # field changes, its value from the previous sample is written
+        # first, so min and max over the change stay exact.
+        if not self.enabled:
+            return [(timestamp, data)]
+        if self.keyframe_time is None or timestamp - self.keyframe_time >= self.keyframe * 1000000000:
+            self.keyframe_time = timestamp
+            self.previous_time = timestamp
+            self.last = dict(data)
+            self.last_time = dict.fromkeys(data, timestamp)
+            self.held = {}
+            self.written += len(data)
+            return [(timestamp, data)]
+        fields = {}
+        closing = {}
+        held = {}
+        for field, value in data.items():
+            deduplicated, tolerance = self._rule(field)
+            if deduplicated and field in self.last and self._same(self.last[field], value, tolerance):
+                held[field] = value
+                continue
+            fields[field] = value
+            self.last[field] = value
+            self.last_time[field] = timestamp
+            if field in self.held:
+                closing[field] = self.held[field]
+        points = []
+        if len(closing) > 0:
+            points.append((self.previous_time, closing))
+        if len(fields) > 0:
+            points.append((timestamp, fields))
+        self.held = held
+        self.previous_time = timestamp
+        self.written += len(fields) + len(closing)
+        self.dropped += len(held)
+        return points
+
+    def seed(self):
+        # Last written values as (time ns, fields), oldest first, so reads
+        # can fill fields without looking for them in the database
+        last = dict(self.last)
+        last_time = dict(self.last_time)
+        points = {}
+        for field, value in last.items():
+            if field in last_time:
+                points.setdefault(last_time[field], {})[field] = value
+        return sorted(points.items())
+
+    def stats(self):
+        return {
+            "keyframe": self.keyframe,
+            "fields_written": self.written,
+            "fields_dropped": self.dropped,
+        }
@@ -0,0 +1,349 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from urllib.request import Request, urlopen
+
+from .utils import log_error
+
+# What a full sink queue does with a new sample
+#   drop_oldest: make room by dropping the oldest queued sample
+#   drop_newest: keep the queue, drop the new sample
+BACKPRESSURE_POLICIES = ['drop_oldest', 'drop_newest']
+
+def escape_key(key):
+    return key.replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+def to_line_protocol(measurement, fields, timestamp, tags=None):
+    # One InfluxDB line protocol line, None when there are no fields
+    encoded = []
+    for key, value in fields.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        elif isinstance(value, int):
+            value = f'{value}i'
+        elif isinstance(value, float):
+            value = repr(value)
+        else:
+            value = '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+        encoded.append(f'{escape_key(key)}={value}')
+    if len(encoded) == 0:
+        return None
+    series = measurement.replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ')
+    for key, value in sorted((tags or {}).items()):
+        series += f',{escape_key(key)}={escape_key(str(value))}'
+    return f'{series} {",".join(encoded)} {timestamp}'
+
+class Sink:
+    # Samples sent per batch
+    BATCH_SIZE = 60
+    # Seconds the oldest queued sample waits before a partial batch is sent
+    FLUSH_AGE = 5
+    # Samples queued before the backpressure policy applies
+    MAX_QUEUE = 3600
+    # Retry backoff bounds in seconds, failed batches go back in the queue
+    RETRY_BACKOFF_MIN = 1
+    RETRY_BACKOFF_MAX = 60
+
+    def __init__(self, name, batch_size=None, flush_age=None, max_queue=None, policy='drop_oldest', get_logger=None):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Invalid backpressure policy: {policy}, choose from {BACKPRESSURE_POLICIES}")
+        if get_logger is None:
+            get_logger = logging.getLogger
+        self.log = get_logger(f'{__name__}.{name}')
+        self.name = name
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.flush_age = flush_age or self.FLUSH_AGE
+        self.max_queue = max_queue or self.MAX_QUEUE
+        self.policy = policy
+
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.thread = None
+        self.running = False
+        self.backoff = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failures = 0
+        self.last_error = None
+
+    def push(self, timestamp, data):
+        # Called from the sampler thread, never blocks on the sink
+        with self.lock:
+            if len(self.queue) >= self.max_queue:
+                self.dropped += 1
+                if self.policy == 'drop_newest':
+                    return
+                self.queue.popleft()
+            self.queue.append((timestamp, data))
+            size = len(self.queue)
+        if size >= self.batch_size and self.backoff == 0:
+            self.event.set()
+
+    def send(self, samples):
+        # [(timestamp ns, data)], raises on failure
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def _take(self):
+        with self.lock:
+            batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+        return batch
+
+    def _requeue(self, batch):
+        with self.lock:
+            self.queue.extendleft(reversed(batch))
+            while len(self.queue) > self.max_queue:
+                self.dropped += 1
+                if self.policy == 'drop_newest':
+                    self.queue.pop()
+                else:
+                    self.queue.popleft()
+
+    def _oldest_age(self):
+        with self.lock:
+            if len(self.queue) == 0:
+                return None
+            oldest = self.queue[0][0]
+        return time.time() - oldest / 1e9
+
+    def flush(self):
+        # Sends queued samples batch by batch, False once a batch fails
+        while True:
+            batch = self._take()
+            if len(batch) == 0:
+                return True
+            try:
+                self.send(batch)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                self._requeue(batch)
+                self.backoff = min(max(self.backoff * 2, self.RETRY_BACKOFF_MIN), self.RETRY_BACKOFF_MAX)
+                self.log.warning(f"Export to {self.name} failed, retrying in {self.backoff}s: {e}")
+                return False
+            self.sent += len(batch)
+            self.backoff = 0
+            if len(self.queue) < self.batch_size:
+                return True
+
+    def loop(self):
+        while self.running:
+            if self.backoff > 0:
+                timeout = self.backoff
+            else:
+                age = self._oldest_age()
+                timeout = self.flush_age if age is None else max(self.flush_age - age, 0)
+            self.event.wait(timeout)
+            self.event.clear()
+            if not self.running:
+                break
+            age = self._oldest_age()
+            if age is not None and (self.backoff > 0 or age >= self.flush_age or len(self.queue) >= self.batch_size):
+                self.flush()
+        self.flush()
+        self.close()
+
+    @log_error
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    @log_error
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.event.set()
+        self.thread.join()
+
+    def stats(self):
+        with self.lock:
+            queued = len(self.queue)
+        return {
+            "type": self.TYPE,
+            "queued": queued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "failures": self.failures,
+            "retry_in": self.backoff,
+            "last_error": self.last_error,
+        }
+
+class MQTTSink(Sink):
+    TYPE = 'mqtt'
+    # Seconds to wait for the broker to accept a connection
+    CONNECT_TIMEOUT = 5
+
+    def __init__(self, name, host, port=1883, username=None, password=None, topic='pm_dashboard', per_field=False, qos=0, **kwargs):
+        # Publishes each sample as JSON to topic, or with per_field each
+        # value to topic/<key>
+        super().__init__(name, **kwargs)
+        self.host = host
+        self.port = int(port)
+        self.username = username
+        self.password = password
+        self.topic = topic
+        self.per_field = per_field
+        self.qos = qos
+        self.client = None
+
+    def connect(self):
+        import paho.mqtt.client as mqtt
+        connected = threading.Event()
+        client = mqtt.Client()
+        if self.username is not None:
+            client.username_pw_set(self.username, self.password)
+        client.on_connect = lambda client, userdata, flags, rc: connected.set() if rc == 0 else None
+        client.connect(self.host, self.port)
+        client.loop_start()
+        if not connected.wait(self.CONNECT_TIMEOUT):
+            client.loop_stop()
+            client.disconnect()
+            raise ConnectionError(f"MQTT broker {self.host}:{self.port} did not accept the connection")
+        self.client = client
+
+    def send(self, samples):
+        if self.client is None or not self.client.is_connected():
+            self.close()
+            self.connect()
+        messages = []
+        for timestamp, data in samples:
+            if self.per_field:
+                for key, value in data.items():
+                    messages.append((f'{self.topic}/{key}', json.dumps(value)))
+            else:
+                messages.append((self.topic, json.dumps({"time": timestamp // 1000000, **data})))
+        infos = [self.client.publish(topic, payload, qos=self.qos) for topic, payload in messages]
+        for info in infos:
+            if self.qos > 0:
+                info.wait_for_publish(self.CONNECT_TIMEOUT)
+            if info.rc != 0:
+                raise ConnectionError(f"MQTT publish failed with code {info.rc}")
+
+    def close(self):
+        if self.client is not None:
+            self.client.loop_stop()
+            self.client.disconnect()
+            self.client = None
+
+class LineProtocolSink(Sink):
+    TYPE = 'line_protocol'
+    # Seconds before a push request is abandoned
+    TIMEOUT = 10
+
+    def __init__(self, name, url, measurement='history', tags=None, headers=None, **kwargs):
+        # url: write endpoint, e.g. http://influxdb:8086/write?db=fleet&precision=ns
+        super().__init__(name, **kwargs)
+        self.url = url
+        self.measurement = measurement
+        self.tags = tags
+        self.headers = headers or {}
+
+    def send(self, samples):
+        lines = [to_line_protocol(self.measurement, data, timestamp, self.tags) for timestamp, data in samples]
+        body = '\n'.join(line for line in lines if line is not None).encode()
+        request = Request(self.url, data=body, method='POST', headers={'Content-Type': 'text/plain; charset=utf-8', **self.headers})
+        with urlopen(request, timeout=self.TIMEOUT) as response:
+            response.read()
+
+class FileSink(Sink):
+    TYPE = 'file'
+    FORMATS = ['jsonl', 'line_protocol']
+    # Bytes before the file is rotated to <path>.1
+    MAX_SIZE = 10 * 1024 * 1024
+
+    def __init__(self, name, path, format='jsonl', measurement='history', max_size=None, **kwargs):
+        if format not in self.FORMATS:
+            raise ValueError(f"Invalid file format: {format}, choose from {self.FORMATS}")
+        super().__init__(name, **kwargs)
+        self.path = path
+        self.format = format
+        self.measurement = measurement
+        self.max_size = max_size or self.MAX_SIZE
+
+    def send(self, samples):
+        lines = []
+        for timestamp, data in samples:
+            if self.format == 'jsonl':
+                lines.append(json.dumps({"time": timestamp, **data}))
+            else:
+                line = to_line_protocol(self.measurement, data, timestamp)
+                if line is not None:
+                    lines.append(line)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_size:
+            os.replace(self.path, self.path + '.1')
+        with open(self.path, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+
+SINK_TYPES = {sink.TYPE: sink for sink in [MQTTSink, LineProtocolSink, FileSink]}
+
+def create_sink(config, get_logger=None):
+    # config: {"type": "mqtt" | "line_protocol" | "file", "name": ..., <sink options>}
+    config = dict(config)
+    sink_type = config.pop('type', None)
+    if sink_type not in SINK_TYPES:
+        raise ValueError(f"Unknown sink type: {sink_type}, choose from {list(SINK_TYPES)}")
+    name = config.pop('name', sink_type)
+    return SINK_TYPES[sink_type](name, get_logger=get_logger, **config)
+
+class Exporter:
+    # Fans every sample out to the sinks, each sink sends from its own
+    # thread so a slow one only fills its own queue
+
+    def __init__(self, get_logger=None):
+        if get_logger is None:
+            get_logger = logging.getLogger
+        self.log = get_logger(__name__)
+        self.get_logger = get_logger
+        self.sinks = {}
+        self.running = False
+
+    @log_error
+    def add_sink(self, config):
+        sink = create_sink(config, get_logger=self.get_logger)
+        old = self.sinks.pop(sink.name, None)
+        if old is not None:
+            old.stop()
+        self.sinks[sink.name] = sink
+        if self.running:
+            sink.start()
+        self.log.info(f"Exporter sink '{sink.name}' ({sink.TYPE}) added")
+        return sink
+
+    @log_error
+    def remove_sink(self, name):
+        sink = self.sinks.pop(name, None)
+        if sink is not None:
+            sink.stop()
+
+    def publish(self, timestamp, data):
+        # DataLogger listener
+        for sink in list(self.sinks.values()):
+            sink.push(timestamp, data)
+
+    @log_error
+    def start(self):
+        self.running = True
+        for sink in list(self.sinks.values()):
+            sink.start()
+
+    @log_error
+    def stop(self):
+        self.running = False
+        for sink in list(self.sinks.values()):
+            sink.stop()
+
+    def stats(self):
+        return {name: sink.stats() for name, sink in list(self.sinks.items())}
@@ -0,0 +1,247 @@
+import csv
+import io
+import zlib
+
+from .exporter import to_line_protocol
+from .schema import HistorySchema
+
+FORMATS = ['csv', 'line_protocol']
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'line_protocol': 'text/plain; charset=utf-8',
+}
+EXTENSIONS = {
+    'csv': 'csv',
+    'line_protocol': 'lp',
+}
+
+# Points encoded per output chunk
+EXPORT_BATCH = 500
+# Points written per import batch
+IMPORT_BATCH = 5000
+# Import errors reported back, the rest are only counted
+MAX_ERRORS = 10
+
+def format_csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float):
+        return repr(value)
+    return value
+
+def parse_value(text):
+    # CSV cell back to the type it was exported from, floats keep their
+    # decimal point so 12.0 stays a float
+    if text == '':
+        return None
+    if text in ['true', 'false']:
+        return text == 'true'
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def _split(text, separator, quotes=False):
+    # Split on separator, skipping backslash escapes and, with quotes,
+    # separators inside double quoted strings
+    parts = []
+    start = 0
+    escaped = False
+    quoted = False
+    for i, char in enumerate(text):
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif quotes and char == '"':
+            quoted = not quoted
+        elif char == separator and not quoted:
+            parts.append(text[start:i])
+            start = i + 1
+    if quoted:
+        raise ValueError('Unterminated string')
+    parts.append(text[start:])
+    return parts
+
+def _unescape(text):
+    result = []
+    escaped = False
+    for char in text:
+        if escaped or char != '\\':
+            result.append(char)
+            escaped = False
+        else:
+            escaped = True
+    return ''.join(result)
+
+def _parse_field(text):
+    if text.startswith('"'):
+        if len(text) < 2 or not text.endswith('"'):
+            raise ValueError(f'Invalid string value: {text}')
+        return _unescape(text[1:-1])
+    if text in ['t', 'T', 'true', 'True', 'TRUE']:
+        return True
+    if text in ['f', 'F', 'false', 'False', 'FALSE']:
+        return False
+    if text.endswith('i') or text.endswith('u'):
+        return int(text[:-1])
+    return float(text)
+
+def parse_line_protocol(line):
+    # Inverse of exporter.to_line_protocol: (measurement, tags, fields, timestamp)
+    parts = [part for part in _split(line.strip(), ' ', quotes=True) if part != '']
+    if len(parts) not in [2, 3]:
+        raise ValueError(f'Invalid line: {line.strip()}')
+    series = _split(parts[0], ',')
+    measurement = _unescape(series[0])
+    tags = {}
+    for tag in series[1:]:
+        key, value = _split(tag, '=')
+        tags[_unescape(key)] = _unescape(value)
+    fields = {}
+    for field in _split(parts[1], ',', quotes=True):
+        key, value = _split_key(field)
+        fields[_unescape(key)] = _parse_field(value)
+    timestamp = int(parts[2]) if len(parts) == 3 else None
+    return measurement, tags, fields, timestamp
+
+def _split_key(field):
+    # key=value where the key itself may contain escaped '='
+    escaped = False
+    for i, char in enumerate(field):
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '=':
+            return field[:i], field[i + 1:]
+    raise ValueError(f'Invalid field: {field}')
+
+class Compressor:
+    # gzip member written as it goes, or a pass through
+    def __init__(self, enabled):
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if enabled else None
+
+    def compress(self, text):
+        data = text.encode()
+        if self.compressor is None:
+            return data
+        return self.compressor.compress(data)
+
+    def flush(self):
+        if self.compressor is None:
+            return b''
+        return self.compressor.flush()
+
+def export_history(db, measurement, start_time, end_time, keys="*", format='csv', compress=False):
+    # Generator of response chunks, memory stays flat however long the range.
+    # CSV columns are keys, or every field the measurement has.
+    if format not in FORMATS:
+        raise ValueError(f"Invalid format: {format}, choose from {FORMATS}")
+    compressor = Compressor(compress)
+    points = db.iter_points(measurement, start_time, end_time, keys)
+    columns = None
+    if format == 'csv':
+        columns = sorted(db.field_keys(measurement)) if keys == "*" else keys.split(",")
+    batch = []
+
+    def encode(batch):
+        if format == 'line_protocol':
+            lines = [to_line_protocol(measurement, fields, timestamp) for timestamp, fields in batch]
+            return ''.join(line + '\n' for line in lines if line is not None)
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        for timestamp, fields in batch:
+            writer.writerow([timestamp] + [format_csv_value(fields.get(column)) for column in columns])
+        return output.getvalue()
+
+    if format == 'csv':
+        yield compressor.compress(','.join(['time'] + columns) + '\n')
+    for point in points:
+        batch.append(point)
+        if len(batch) < EXPORT_BATCH:
+            continue
+        data = compressor.compress(encode(batch))
+        batch = []
+        if len(data) > 0:
+            yield data
+    yield compressor.compress(encode(batch)) + compressor.flush()
+
+def import_history(db, lines, format='line_protocol', measurement='history', batch_size=None):
+    # lines: iterable of str or bytes, like a request body stream. Points
+    # are written in batches, invalid lines are skipped and counted.
+    # Returns {"points", "skipped", "errors", "start", "end"}, times in ns.
+    if format not in FORMATS:
+        raise ValueError(f"Invalid format: {format}, choose from {FORMATS}")
+    batch_size = batch_size or IMPORT_BATCH
+    result = {"points": 0, "skipped": 0, "errors": [], "start": None, "end": None}
+    batch = []
+    header = None
+    # Inventory of imported points is tracked on its own, the live
+    # writer's is for newer points and would skip it
+    history_schema = HistorySchema()
+
+    def skip(number, error):
+        result["skipped"] += 1
+        if len(result["errors"]) < MAX_ERRORS:
+            result["errors"].append(f"line {number}: {error}")
+
+    def write(batch):
+        status, error = db.write_points(batch, history_schema)
+        if not status:
+            raise IOError(f"Failed to write points: {error}")
+        result["points"] += len(batch)
+        start = min(point["time"] for point in batch)
+        end = max(point["time"] for point in batch)
+        result["start"] = start if result["start"] is None else min(result["start"], start)
+        result["end"] = end if result["end"] is None else max(result["end"], end)
+
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode()
+        if format == 'csv':
+            if header is None:
+                header = next(csv.reader([line]))
+                if len(header) == 0 or header[0] != 'time':
+                    raise ValueError("CSV must start with a header whose first column is time")
+                continue
+            if line.strip() == '':
+                continue
+            try:
+                row = next(csv.reader([line]))
+                if len(row) != len(header):
+                    raise ValueError(f"Expected {len(header)} columns, got {len(row)}")
+                fields = {key: parse_value(value) for key, value in zip(header[1:], row[1:]) if value != ''}
+                point = {"measurement": measurement, "time": int(row[0]), "fields": fields}
+            except ValueError as e:
+                skip(number, e)
+                continue
+        else:
+            if line.strip() == '' or line.startswith('#'):
+                continue
+            try:
+                point_measurement, tags, fields, timestamp = parse_line_protocol(line)
+                if timestamp is None:
+                    raise ValueError("Missing timestamp")
+                point = {"measurement": point_measurement, "time": timestamp, "fields": fields}
+                if len(tags) > 0:
+                    point["tags"] = tags
+            except ValueError as e:
+                skip(number, e)
+                continue
+        if len(point["fields"]) == 0:
+            skip(number, "No fields")
+            continue
+        batch.append(point)
+        if len(batch) >= batch_size:
+            write(batch)
+            batch = []
+    if len(batch) > 0:
+        write(batch)
+    return result
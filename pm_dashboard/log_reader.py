@@ -0,0 +1,95 @@
+import os
+
+DEBUG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+
+# Bytes read per step when scanning backwards from the end of a file
+BLOCK_SIZE = 8192
+
+def get_log_level(line):
+    for level in DEBUG_LEVELS:
+        if f"[{level}]" in line:
+            return level
+    return 'INFO'
+
+def make_line_filter(filter=[], level="INFO"):
+    levels = DEBUG_LEVELS[DEBUG_LEVELS.index(level):]
+    def check(line):
+        if len(filter) > 0 and not any(f in line for f in filter):
+            return False
+        return get_log_level(line) in levels
+    return check
+
+def reverse_lines(f, block_size=BLOCK_SIZE):
+    # Yields lines of a binary file from the last to the first, reading
+    # fixed size blocks backwards so memory doesn't grow with file size
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    rest = b''
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        f.seek(position)
+        block = f.read(size) + rest
+        lines = block.split(b'\n')
+        # First piece may be the end of a line that starts in an earlier block
+        rest = lines.pop(0)
+        for line in reversed(lines):
+            yield line
+    yield rest
+
+def tail(file_path, line_count=100, filter=[], level="INFO"):
+    check = make_line_filter(filter, level)
+    data = []
+    with open(file_path, 'rb') as f:
+        last = True
+        for line in reverse_lines(f):
+            line = line.rstrip(b'\r').decode('utf-8', errors='replace')
+            if last:
+                last = False
+                # Text after the final newline, if any, has no newline
+                if line == '':
+                    continue
+            else:
+                line += '\n'
+            if check(line):
+                data.append(line)
+                if len(data) >= line_count:
+                    break
+    data.reverse()
+    return data
+
+# Max bytes returned by one read_since call
+MAX_READ_SIZE = 1024 * 1024
+
+def read_since(file_path, offset=None, inode=None, filter=[], level="INFO", max_size=MAX_READ_SIZE):
+    # Lines appended since a (offset, inode) cursor. Starts from the end of
+    # the file without a cursor, and from the start again if the file was
+    # rotated (new inode) or truncated (shorter than offset).
+    check = make_line_filter(filter, level)
+    with open(file_path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        reset = False
+        if offset is None:
+            offset = stat.st_size
+        elif (inode is not None and inode != stat.st_ino) or offset > stat.st_size:
+            offset = 0
+            reset = True
+        f.seek(offset)
+        chunk = f.read(min(stat.st_size - offset, max_size))
+    # Only return complete lines, a partial last line is read next time
+    end = chunk.rfind(b'\n') + 1
+    if end == 0 and len(chunk) == max_size:
+        # Line longer than max_size, return it in pieces
+        end = len(chunk)
+    data = []
+    for line in chunk[:end].splitlines(keepends=True):
+        line = line.decode('utf-8', errors='replace').replace('\r\n', '\n')
+        if check(line):
+            data.append(line)
+    return {
+        "lines": data,
+        "offset": offset + end,
+        "inode": stat.st_ino,
+        "reset": reset,
+        "more": offset + len(chunk) < stat.st_size,
+    }
@@ -0,0 +1,160 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds, fixed so an observation is a bisect and an add
+BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = list(buckets)
+        self.lock = threading.Lock()
+        # label values -> [counts per bucket and +Inf, sum]
+        self.children = {}
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            child = self.children.get(label_values)
+            if child is None:
+                child = [[0] * (len(self.buckets) + 1), 0]
+                self.children[label_values] = child
+            child[0][index] += 1
+            child[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def collect(self):
+        # [(label values, cumulative bucket counts, count, sum)]
+        with self.lock:
+            children = [(label_values, list(counts), total) for label_values, (counts, total) in self.children.items()]
+        result = []
+        for label_values, counts, total in children:
+            cumulative = []
+            count = 0
+            for c in counts:
+                count += c
+                cumulative.append(count)
+            result.append((label_values, cumulative, count, total))
+        return result
+
+class Gauge:
+    def __init__(self, name, help, func, labels=()):
+        # func() returns a value, or {label values: value} with labels
+        self.name = name
+        self.help = help
+        self.func = func
+        self.labels = tuple(labels)
+
+    def collect(self):
+        value = self.func()
+        if len(self.labels) == 0:
+            return [((), value)]
+        return list(value.items())
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Histogram(name, help, labels, buckets)
+            return self.metrics[name]
+
+    def gauge(self, name, help, func, labels=()):
+        # Replaces an existing gauge, its func usually holds an instance
+        with self.lock:
+            self.metrics[name] = Gauge(name, help, func, labels)
+            return self.metrics[name]
+
+    def remove(self, name):
+        with self.lock:
+            self.metrics.pop(name, None)
+
+    @staticmethod
+    def format_labels(names, values, extra=None):
+        pairs = [(name, str(value)) for name, value in zip(names, values)]
+        if extra is not None:
+            pairs.append(extra)
+        if len(pairs) == 0:
+            return ''
+        escaped = [(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs]
+        return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+    def render(self):
+        # Prometheus text exposition format 0.0.4
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            if isinstance(metric, Histogram):
+                lines.append(f'# HELP {metric.name} {metric.help}')
+                lines.append(f'# TYPE {metric.name} histogram')
+                for label_values, cumulative, count, total in metric.collect():
+                    bounds = [str(b) for b in metric.buckets] + ['+Inf']
+                    for bound, value in zip(bounds, cumulative):
+                        labels = self.format_labels(metric.labels, label_values, ('le', bound))
+                        lines.append(f'{metric.name}_bucket{labels} {value}')
+                    labels = self.format_labels(metric.labels, label_values)
+                    lines.append(f'{metric.name}_sum{labels} {total}')
+                    lines.append(f'{metric.name}_count{labels} {count}')
+            else:
+                try:
+                    values = metric.collect()
+                except Exception:
+                    continue
+                lines.append(f'# HELP {metric.name} {metric.help}')
+                lines.append(f'# TYPE {metric.name} gauge')
+                for label_values, value in values:
+                    if value is None:
+                        continue
+                    labels = self.format_labels(metric.labels, label_values)
+                    lines.append(f'{metric.name}{labels} {float(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self):
+        data = {}
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            series = []
+            if isinstance(metric, Histogram):
+                for label_values, cumulative, count, total in metric.collect():
+                    series.append({
+                        "labels": dict(zip(metric.labels, label_values)),
+                        "buckets": dict(zip([str(b) for b in metric.buckets] + ['+Inf'], cumulative)),
+                        "count": count,
+                        "sum": total,
+                    })
+            else:
+                try:
+                    values = metric.collect()
+                except Exception:
+                    continue
+                for label_values, value in values:
+                    series.append({
+                        "labels": dict(zip(metric.labels, label_values)),
+                        "value": value,
+                    })
+            data[metric.name] = series
+        return data
+
+REGISTRY = Registry()
+
+def histogram(name, help, labels=(), buckets=BUCKETS):
+    return REGISTRY.histogram(name, help, labels, buckets)
+
+def gauge(name, help, func, labels=()):
+    return REGISTRY.gauge(name, help, func, labels)
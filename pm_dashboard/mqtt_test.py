@@ -0,0 +1,134 @@
+import hashlib
+import threading
+import time
+import uuid
+
+class MQTTTestJob:
+    STATE_RUNNING = 'running'
+    STATE_DONE = 'done'
+
+    def __init__(self, job_id, key, config):
+        self.id = job_id
+        self.key = key
+        self.config = config
+        self.state = self.STATE_RUNNING
+        self.status = None
+        self.error = None
+        self.connected = None
+        self.created = time.monotonic()
+        self.finished = None
+        self.event = threading.Event()
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.finished = time.monotonic()
+        self.state = self.STATE_DONE
+        # Credentials aren't needed once the test is over
+        self.config = None
+        self.event.set()
+
+    def wait(self, timeout):
+        return self.event.wait(timeout)
+
+    def to_dict(self, cached=False):
+        return {
+            "id": self.id,
+            "state": self.state,
+            "status": self.status,
+            "error": self.error,
+            "cached": cached,
+            "age": time.monotonic() - self.created,
+        }
+
+class MQTTTester:
+    # Tests running at the same time, each holds a thread and a connection
+    MAX_CONCURRENT = 4
+    # Seconds a finished result is reused for the same broker and credentials
+    RESULT_TTL = 30
+    # Seconds a finished job can still be polled
+    JOB_TTL = 300
+    # Seconds a test waits for the broker to accept the connection
+    TIMEOUT = 5
+
+    def __init__(self, max_concurrent=None, result_ttl=None, timeout=None):
+        self.max_concurrent = max_concurrent or self.MAX_CONCURRENT
+        self.result_ttl = result_ttl if result_ttl is not None else self.RESULT_TTL
+        self.timeout = timeout or self.TIMEOUT
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.running = 0
+
+    @staticmethod
+    def make_key(config):
+        # The password only as a digest, keys outlive the job
+        password = hashlib.sha256(config['password'].encode()).hexdigest()
+        return (config['host'], config['port'], config['username'], password)
+
+    def start(self, config):
+        # Returns (job, cached), job is None when too many tests are running
+        key = self.make_key(config)
+        now = time.monotonic()
+        with self.lock:
+            self._prune(now)
+            latest = None
+            for job in self.jobs.values():
+                if job.key == key and (latest is None or job.created > latest.created):
+                    latest = job
+            if latest is not None:
+                if latest.state == MQTTTestJob.STATE_RUNNING:
+                    return latest, False
+                if now - latest.finished < self.result_ttl:
+                    return latest, True
+            if self.running >= self.max_concurrent:
+                return None, False
+            self.running += 1
+            job = MQTTTestJob(uuid.uuid4().hex[:16], key, config)
+            self.jobs[job.id] = job
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        return job, False
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _prune(self, now):
+        for job_id, job in list(self.jobs.items()):
+            if job.state == MQTTTestJob.STATE_DONE and now - job.finished > self.JOB_TTL:
+                del self.jobs[job_id]
+
+    def _run(self, job):
+        try:
+            status, error = self._test(job)
+        except Exception as e:
+            status, error = False, str(e)
+        with self.lock:
+            self.running -= 1
+        job.finish(status, error)
+
+    def _test(self, job):
+        import paho.mqtt.client as mqtt
+        config = job.config
+
+        def on_connect(client, userdata, flags, rc):
+            job.connected = rc == 0
+
+        client = mqtt.Client()
+        client.on_connect = on_connect
+        client.username_pw_set(config['username'], config['password'])
+        try:
+            client.connect(config['host'], config['port'])
+        except OSError:
+            return False, "Connection failed, Check hostname and port"
+        try:
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
+                # Blocks on the socket for up to 0.1s, not a busy loop
+                client.loop(timeout=0.1)
+                if job.connected == True:
+                    return True, None
+                elif job.connected == False:
+                    return False, "Connection failed, Check username and password"
+            return False, "Timeout"
+        finally:
+            client.disconnect()
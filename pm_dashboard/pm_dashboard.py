@@ -1,21 +1,27 @@
 
+import gzip
 import threading
 import logging
+import time
 from os import listdir, path, remove
 
 import flask
-from flask import request, send_from_directory
+from flask import request, Response
 from flask_cors import CORS, cross_origin
 from importlib.resources import files as resource_files
-from werkzeug.serving import make_server
 
-from .data_logger import DataLogger
-from .database import Database
+from . import metrics
+from .alerts import AlertEngine, ALERTS_MEASUREMENT
+from .batch_query import BatchQuery
+from .exporter import Exporter
+from . import history_io
+from .mqtt_test import MQTTTester
+from .log_reader import DEBUG_LEVELS, tail, read_since
+from .server import create_server
+from .static_assets import StaticAssets
+from .stream import SampleStream
 from .utils import log_error, merge_dict
 import logging
-from sf_rpi_status import get_disks, get_ips
-
-DEBUG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
 
 __package_name__ = __name__.split('.')[0]
 __log_path__ = '/var/log/pironman5'
@@ -24,9 +30,14 @@ __api_prefix__ = '/api/v1.0'
 __host__ = '0.0.0.0'
 __port__ = 34001
 __log__ = None
+__stream_heartbeat__ = 15
+__stream_max_clients__ = 8
 
 __db__ = None
 __data_logger__ = None
+__exporter__ = None
+__alerts__ = None
+__stream__ = SampleStream()
 __config__ = {}
 __app__ = flask.Flask(__name__, static_folder=__www_path__)
 
@@ -34,10 +45,16 @@ __app__.logger.setLevel(logging.WARN)
 logging.getLogger('werkzeug').setLevel(logging.ERROR)
 
 
+__static_assets__ = StaticAssets(__www_path__)
+
 __cors__ = CORS(__app__)
 __app__.config['CORS_HEADERS'] = 'Content-Type'
 __device_info__ = {}
-__mqtt_connected__ = False
+__request_seconds__ = metrics.histogram('pm_dashboard_request_seconds', 'Time to handle a request, up to the response headers', ['route', 'method'])
+__mqtt_tester__ = MQTTTester()
+__batch_query__ = BatchQuery()
+# Longest get-mqtt-test long poll in seconds
+__mqtt_test_max_wait__ = 10
 __enable_history__ = False
 
 __on_outside_config_changed__ = lambda config: None
@@ -49,81 +66,57 @@ def __on_config_changed__(config):
     __on_inside_config_changed__(config)
     __config__ = merge_dict(__config__, config)
 
-def on_mqtt_connected(client, userdata, flags, rc):
-    global __mqtt_connected__
-    if rc==0:
-        __mqtt_connected__ = True
-    else:
-        __mqtt_connected__ = False
-
 def _get_log(name, line_count=100, filter=[], level="INFO"):
     if path.exists(f"{__log_path__}/{name}") == False:
         return False
-    with open(f"{__log_path__}/{name}", 'r') as f:
-        lines = f.readlines()
-        lines = lines[-line_count:]
-        data = []
-        for line in lines:
-            check = True
-            if len(filter) > 0:
-                for f in filter:
-                    if f in line:
-                        break
-                else:
-                    check = False
-            log_level = DEBUG_LEVELS.index(level)
-            current_log_level = DEBUG_LEVELS.index(get_log_level(line))
-            if current_log_level < log_level:
-                check = False
-            if check:
-                data.append(line)
-        return data
-
-def _test_mqtt(config, timeout=5):
-    global __mqtt_connected__
-    import paho.mqtt.client as mqtt
-    from socket import gaierror
-    import time
-    __mqtt_connected__ = None
-    client = mqtt.Client()
-    client.on_connect = on_mqtt_connected
-    client.username_pw_set(config['username'], config['password'])
-    try:
-        client.connect(config['host'], config['port'])
-    except gaierror:
-        return False, "Connection failed, Check hostname and port"
-    timestart = time.time()
-    while time.time() - timestart < timeout:
-        client.loop()
-        if __mqtt_connected__ == True:
-            return True, None
-        elif __mqtt_connected__ == False:
-            return False, "Connection failed, Check username and password"
-    return False, "Timeout"
-
-def get_log_level(line):
-    for level in DEBUG_LEVELS:
-        if f"[{level}]" in line:
-            return level
-    return 'INFO'
+    return tail(f"{__log_path__}/{name}", line_count, filter, level)
+
+def _history_error():
+    # Why history can't be read right now, None once it can. The database
+    # starts in the background, until then live data is served instead.
+    if not __enable_history__:
+        return "History is not enabled"
+    if __db__ is None or not __data_logger__.history_enabled:
+        return "History is not ready"
+    return None
+
+@__app__.before_request
+def start_request_timer():
+    flask.g.request_start = time.perf_counter()
+
+@__app__.after_request
+def observe_request(response):
+    start = flask.g.get('request_start')
+    if start is not None:
+        # Route pattern rather than path, keeps the label set small
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        __request_seconds__.observe(time.perf_counter() - start, route, request.method)
+    return response
+
+def _get_cache_stats():
+    if __db__ is None:
+        return {}
+    return {(name,): value for name, value in __db__.get_cache_stats().items()}
+
+# Prometheus metrics of the dashboard process itself
+@__app__.route('/metrics')
+def get_metrics_text():
+    return Response(metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 # Host dashboard page
 @__app__.route('/')
 @cross_origin()
 def dashboard():
-    with open(f'{__app__.static_folder}/index.html') as f:
-        return f.read()
+    return __static_assets__.response('index.html')
 
 # Host static files for dashboard page
 @__app__.route('/<path:filename>')
 @cross_origin()
 def serve_static(filename):
-    path = __app__.static_folder
-    if '/' in filename:
-        items = filename.split('/')
-        filename = items[-1]
-        path = path + '/' + '/'.join(items[:-1])
-    return send_from_directory(path, filename)
+    response = __static_assets__.response(filename)
+    if response is None:
+        flask.abort(404)
+    return response
 
 # host API
 @__app__.route(f'{__api_prefix__}/get-version')
@@ -141,53 +134,66 @@ def get_device_info():
 def test():
     return {"status": True, "data": "OK"}
 
+def _get_mqtt_config():
+    # (config, error) from the request arguments
+    config = {}
+    for name in ['host', 'port', 'username', 'password']:
+        value = request.args.get(name)
+        if value is None:
+            return None, f"[ERROR] {name} not found"
+        config[name] = value
+    try:
+        config['port'] = int(config['port'])
+    except ValueError:
+        return None, f"[ERROR] port {config['port']} is not a number"
+    return config, None
+
 @__app__.route(f'{__api_prefix__}/test-mqtt')
 @cross_origin()
 def test_mqtt():
-    host = request.args.get("host")
-    port = request.args.get("port")
-    username = request.args.get("username")
-    password = request.args.get("password")
-    mqtt_config = {}
-    data = None
-    status = True
-    error = None
-    if host is None:
-        status = False
-        error = "[ERROR] host not found"
-    elif port is None:
-        status = False
-        error = "[ERROR] port not found"
-    elif username is None:
-        status = False
-        error = "[ERROR] username not found"
-    elif password is None:
-        status = False
-        error = "[ERROR] password not found"
-    else:
-        mqtt_config['host'] = host
-        mqtt_config['port'] = int(host)
-        mqtt_config['username'] = username
-        mqtt_config['password'] = password
-        result = _test_mqtt(mqtt_config)
-        data = {
-            "status": result[0],
-            "error": result[1]
-        }
-        status = True
-    result = {"status": status}
-    if status:
-        result['data'] = data
-    else:
-        result['error'] = error
-    return result
+    # Waits for the result, start-mqtt-test and get-mqtt-test don't
+    config, error = _get_mqtt_config()
+    if error is not None:
+        return {"status": False, "error": error}
+    job, _ = __mqtt_tester__.start(config)
+    if job is None:
+        return {"status": False, "error": "[ERROR] Too many MQTT tests running, try again later"}
+    job.wait(__mqtt_tester__.timeout + 5)
+    return {"status": True, "data": {"status": job.status, "error": job.error if job.state == job.STATE_DONE else "Timeout"}}
+
+@__app__.route(f'{__api_prefix__}/start-mqtt-test')
+@cross_origin()
+def start_mqtt_test():
+    config, error = _get_mqtt_config()
+    if error is not None:
+        return {"status": False, "error": error}
+    job, cached = __mqtt_tester__.start(config)
+    if job is None:
+        return {"status": False, "error": "[ERROR] Too many MQTT tests running, try again later"}
+    return {"status": True, "data": job.to_dict(cached)}
+
+@__app__.route(f'{__api_prefix__}/get-mqtt-test')
+@cross_origin()
+def get_mqtt_test():
+    job_id = request.args.get("id")
+    if job_id is None:
+        return {"status": False, "error": "[ERROR] id not found"}
+    job = __mqtt_tester__.get(job_id)
+    if job is None:
+        return {"status": False, "error": f"[ERROR] MQTT test {job_id} not found"}
+    # Long poll, hold the request up to wait seconds for the result
+    wait = min(float(request.args.get("wait", 0)), __mqtt_test_max_wait__)
+    if wait > 0:
+        job.wait(wait)
+    return {"status": True, "data": job.to_dict()}
 
 @__app__.route(f'{__api_prefix__}/get-data')
 @cross_origin()
 def get_data():
     try:
-        if __enable_history__ == False:
-            data = __data_logger__.get_data()
+        if _history_error() is not None:
+            data, age = __data_logger__.get_snapshot()
+            return {"status": True, "data": data, "age": age}
         else:
             num = request.args.get("n")
             if num is None:
@@ -199,12 +205,65 @@ def get_data():
     except Exception as e:
         return {"status": False, "error": str(e)}
 
+@__app__.route(f'{__api_prefix__}/get-sampler-stats')
+@cross_origin()
+def get_sampler_stats():
+    try:
+        return {"status": True, "data": __data_logger__.get_sampler_stats()}
+    except Exception as e:
+        return {"status": False, "error": str(e)}
+
+@__app__.route(f'{__api_prefix__}/get-exporter-stats')
+@cross_origin()
+def get_exporter_stats():
+    if __exporter__ is None:
+        return {"status": True, "data": {}}
+    return {"status": True, "data": __exporter__.stats()}
+
+@__app__.route(f'{__api_prefix__}/get-alerts')
+@cross_origin()
+def get_alerts():
+    n = request.args.get("n")
+    if n is not None:
+        n = int(n)
+    if __alerts__ is None:
+        return {"status": True, "data": {"active": [], "events": []}}
+    return {"status": True, "data": {"active": __alerts__.get_active(), "events": __alerts__.get_events(n)}}
+
+@__app__.route(f'{__api_prefix__}/get-alert-rules')
+@cross_origin()
+def get_alert_rules():
+    if __alerts__ is None:
+        return {"status": True, "data": []}
+    return {"status": True, "data": __alerts__.get_rules()}
+
+@__app__.route(f'{__api_prefix__}/get-alert-history')
+@cross_origin()
+def get_alert_history():
+    try:
+        error = _history_error()
+        if error is not None:
+            return {"status": False, "error": error}
+        n = int(request.args.get("n", 100))
+        data = __db__.get(ALERTS_MEASUREMENT, n=n)
+        if n == 1:
+            data = [] if data is None else [data]
+        return {"status": True, "data": data}
+    except Exception as e:
+        return {"status": False, "error": str(e)}
+
+@__app__.route(f'{__api_prefix__}/get-metrics')
+@cross_origin()
+def get_metrics():
+    return {"status": True, "data": metrics.REGISTRY.to_dict()}
+
 @__app__.route(f'{__api_prefix__}/get-history')
 @cross_origin()
 def get_history():
     try:
-        if __enable_history__ == False:
-            data = __data_logger__.get_data()
+        if _history_error() is not None:
+            data, age = __data_logger__.get_snapshot()
+            return {"status": True, "data": data, "age": age}
         else:
             num = request.args.get("n")
             if num is None:
@@ -216,18 +275,137 @@ def get_history():
     except Exception as e:
         return {"status": False, "error": str(e)}
 
+@__app__.route(f'{__api_prefix__}/stream')
+@cross_origin()
+def stream():
+    keys = request.args.get("keys")
+    if keys is not None:
+        keys = keys.split(',')
+    delta = request.args.get("delta", "false").lower() in ['1', 'true']
+    if __stream_max_clients__ == 0:
+        return {"status": False, "error": "[ERROR] stream is not available in single server mode"}, 503
+    if __stream__.count() >= __stream_max_clients__:
+        # Each stream holds a server worker, keep some for other requests
+        return {"status": False, "error": "[ERROR] too many stream clients"}, 503
+    subscriber = __stream__.subscribe(keys, delta)
+
+    def generate():
+        try:
+            # Start with the latest sample so clients don't wait an interval
+            data, _ = __data_logger__.get_snapshot()
+            if data is not None:
+                yield subscriber.event(time.time_ns(), data)
+            while not subscriber.closed:
+                sample = subscriber.get(timeout=__stream_heartbeat__)
+                if subscriber.closed:
+                    break
+                if sample is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                event = subscriber.event(*sample)
+                if event is not None:
+                    yield event
+        finally:
+            __stream__.unsubscribe(subscriber)
+
+    headers = {
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    }
+    return Response(generate(), mimetype='text/event-stream', headers=headers)
+
 @__app__.route(f'{__api_prefix__}/get-time-range')
 @cross_origin()
 def get_time_range():
     try:
-        if __enable_history__:
+        error = _history_error()
+        if error is None:
             start = request.args.get("start")
             end = request.args.get("end")
             key = request.args.get("key")
-            data = __db__.get_data_by_time_range("history", start, end, key)
+            function = request.args.get("function", "mean")
+            max_size = int(request.args.get("max_size", 300))
+            format = request.args.get("format", "points")
+            if format == "columnar":
+                time_delta = request.args.get("delta", "false").lower() in ['1', 'true']
+                precision = request.args.get("precision")
+                if precision is not None:
+                    precision = int(precision)
+                data = __db__.get_columns_by_time_range("history", start, end, key, function, max_size, time_delta=time_delta, precision=precision)
+            elif format == "points":
+                data = __db__.get_data_by_time_range("history", start, end, key, function, max_size)
+            else:
+                return {"status": False, "error": f"[ERROR] format {format} not found, available formats: points, columnar"}
             return {"status": True, "data": data}
         else:
-            return {"status": False, "error": "History is not enabled"}
+            return {"status": False, "error": error}
+    except Exception as e:
+        return {"status": False, "error": str(e)}
+
+@__app__.route(f'{__api_prefix__}/get-time-ranges', methods=['POST'])
+@cross_origin()
+def get_time_ranges():
+    try:
+        error = _history_error()
+        if error is not None:
+            return {"status": False, "error": error}
+        queries = request.json.get("queries")
+        if not isinstance(queries, list):
+            return {"status": False, "error": "[ERROR] queries must be a list"}
+        return {"status": True, "data": __batch_query__.run(__db__, "history", queries)}
+    except Exception as e:
+        return {"status": False, "error": str(e)}
+
+@__app__.route(f'{__api_prefix__}/export-history')
+@cross_origin()
+def export_history():
+    error = _history_error()
+    if error is not None:
+        return {"status": False, "error": error}
+    start = request.args.get("start")
+    end = request.args.get("end")
+    if start is None or end is None:
+        return {"status": False, "error": "[ERROR] start and end are required"}
+    key = request.args.get("key", "*")
+    format = request.args.get("format", "csv")
+    if format not in history_io.FORMATS:
+        return {"status": False, "error": f"[ERROR] format {format} not found, available formats: {', '.join(history_io.FORMATS)}"}
+    compress = request.args.get("gzip", "false").lower() in ['1', 'true']
+    if not __db__.is_ready():
+        return {"status": False, "error": "Database is not ready"}
+    chunks = history_io.export_history(__db__, "history", int(start), int(end), key, format, compress)
+
+    def generate():
+        try:
+            yield from chunks
+        except Exception as e:
+            # Headers are already sent, the client sees a truncated file
+            __log__.error(f"History export failed: {e}")
+
+    filename = f'history-{start}-{end}.{history_io.EXTENSIONS[format]}'
+    headers = {'Content-Disposition': f'attachment; filename="{filename}.gz"' if compress else f'attachment; filename="{filename}"'}
+    content_type = 'application/gzip' if compress else history_io.CONTENT_TYPES[format]
+    return Response(generate(), content_type=content_type, headers=headers)
+
+@__app__.route(f'{__api_prefix__}/import-history', methods=['POST'])
+@cross_origin()
+def import_history():
+    try:
+        error = _history_error()
+        if error is not None:
+            return {"status": False, "error": error}
+        format = request.args.get("format", "line_protocol")
+        if format not in history_io.FORMATS:
+            return {"status": False, "error": f"[ERROR] format {format} not found, available formats: {', '.join(history_io.FORMATS)}"}
+        stream = request.stream
+        if request.headers.get("Content-Encoding") == "gzip" or request.args.get("gzip", "false").lower() in ['1', 'true']:
+            stream = gzip.GzipFile(fileobj=stream)
+        result = history_io.import_history(__db__, stream, format)
+        if result["points"] > 0:
+            # Rollups and cached buckets don't know about the imported range yet
+            __db__.rollup_range(result["start"], result["end"])
+            __db__.invalidate_cache()
+        return {"status": True, "data": result}
     except Exception as e:
         return {"status": False, "error": str(e)}
 
@@ -269,20 +447,52 @@ def get_log():
         return {"status": False, "error": f"[ERROR] file {filename} not found"}
     return {"status": True, "data": content}
 
+@__app__.route(f'{__api_prefix__}/get-log-since')
+@cross_origin()
+def get_log_since():
+    filename = request.args.get("filename")
+    filter = request.args.get("filter")
+    level = request.args.get("level")
+    offset = request.args.get("offset")
+    inode = request.args.get("inode")
+    if filename is None:
+        return {"status": False, "error": "[ERROR] file not found"}
+    if path.exists(f"{__log_path__}/{filename}") == False:
+        return {"status": False, "error": f"[ERROR] file {filename} not found"}
+    if offset is not None:
+        offset = int(offset)
+    if inode is not None:
+        inode = int(inode)
+    if filter is not None:
+        filter = filter.split(',')
+    else:
+        filter = []
+    if level is None:
+        level = "INFO"
+    elif level not in DEBUG_LEVELS:
+        return {"status": False, "error": f"[ERROR] level {level} not found"}
+    data = read_since(f"{__log_path__}/{filename}", offset, inode, filter, level)
+    return {"status": True, "data": data}
+
 @__app__.route(f'{__api_prefix__}/get-default-on')
 @cross_origin()
 def get_default_on():
+    if _history_error() is not None:
+        data, _ = __data_logger__.get_snapshot()
+        return {"status": True, "data": None if data is None else data.get("default_on")}
     default_on = __db__.get("history", "default_on")
     return {"status": True, "data": default_on}
 
 @__app__.route(f'{__api_prefix__}/get-disk-list')
 @cross_origin()
 def get_disk_list():
+    from sf_rpi_status import get_disks
     return {"status": True, "data": get_disks()}
 
 @__app__.route(f'{__api_prefix__}/get-network-interface-list')
 @cross_origin()
 def get_network_interface_list():
+    from sf_rpi_status import get_ips
     interfaces = list(get_ips().keys())
     return {"status": True, "data": interfaces}
 
@@ -386,6 +596,7 @@ def set_oled_enable():
 @__app__.route(f'{__api_prefix__}/set-oled-disk', methods=['POST'])
 @cross_origin()
 def set_oled_disk():
+    from sf_rpi_status import get_disks
     disk = request.json["disk"]
     disks = ["total"]
     disks.extend(get_disks())
@@ -400,6 +611,7 @@ def set_oled_disk():
 @__app__.route(f'{__api_prefix__}/set-oled-network-interface', methods=['POST'])
 @cross_origin()
 def set_oled_network_interface():
+    from sf_rpi_status import get_ips
     interface = request.json["interface"]
     interfaces = ['all']
     interfaces.extend(get_ips().keys())
@@ -423,8 +635,9 @@ def set_oled_rotation():
 @__app__.route(f'{__api_prefix__}/clear-history', methods=['POST', 'GET'])
 @cross_origin()
 def clear_history():
-    if __enable_history__ == False:
-        return {"status": False, "error": "History is not enabled"}
+    error = _history_error()
+    if error is not None:
+        return {"status": False, "error": error}
     __db__.clear_measurement('history')
     return {"status": True, "data": "OK"}
 
@@ -461,15 +674,19 @@ def get_ups_blackout_simulation():
 
 
 class PMDashboard():
-    def __init__(self, device_info=None, database='pm_dashboard', spc_enabled=False, config=None, get_logger=None):
+    def __init__(self, device_info=None, database='pm_dashboard', spc_enabled=False, config=None, get_logger=None,
+                 server_mode='pool', max_workers=16, request_timeout=5, database_backend='influxdb', overrun_policy='skip', exporters=None, alert_rules=None,
+                 dedup_fields=None, dedup_epsilon=None, keyframe=None):
         global __config__, __device_info__, __on_inside_config_changed__, __log_path__, __enable_history__
-        global __data_logger__, __db__, __log__
+        global __data_logger__, __db__, __log__, __stream_max_clients__, __exporter__, __alerts__
         __device_info__ = device_info
         if 'app_name' in __device_info__:
             app_name = __device_info__['app_name']
         else:
             app_name = __device_info__['id']
         __log_path__ = f'/var/log/{app_name}'
+        journal_path = f'/var/lib/{app_name}/history.journal'
+        database_path = f'/var/lib/{app_name}/{database}.db'
 
         if get_logger is None:
             get_logger = logging.getLogger
@@ -481,22 +698,64 @@ class PMDashboard():
             __config__['system']['enable_history'] = False
         __enable_history__ = config['system']['enable_history']
 
+        # Imported here, it pulls in sf_rpi_status
+        from .data_logger import DataLogger
         self.data_logger = DataLogger(
             database=database,
             spc_enabled=spc_enabled,
             interval=__config__['system']['data_interval'],
+            journal_path=journal_path,
+            database_backend=database_backend,
+            database_path=database_path,
+            overrun_policy=overrun_policy,
+            dedup_fields=dedup_fields,
+            dedup_epsilon=dedup_epsilon,
+            keyframe=keyframe,
             get_logger=get_logger)
         __data_logger__ = self.data_logger
-        if __enable_history__:
-            __db__ = Database(database, get_logger=get_logger)
+        __data_logger__.add_listener(__stream__.publish)
+
+        # Forwards samples to MQTT, remote InfluxDB or files
+        self.exporter = Exporter(get_logger=get_logger)
+        for sink in exporters or []:
+            self.exporter.add_sink(sink)
+        __exporter__ = self.exporter
+        __data_logger__.add_listener(self.exporter.publish)
+
+        self.alerts = AlertEngine(record=self.data_logger.record, get_logger=get_logger)
+        for rule in alert_rules or []:
+            try:
+                self.alerts.add_rule(rule)
+            except (ValueError, TypeError) as e:
+                self.log.error(f"Skipping alert rule {rule}: {e}")
+        __alerts__ = self.alerts
+        __data_logger__.add_listener(self.alerts.publish)
+
+        self.server_mode = server_mode
+        self.max_workers = max_workers
+        self.request_timeout = request_timeout
+        if server_mode == 'pool':
+            __stream_max_clients__ = max(max_workers // 2, 1)
+        elif server_mode == 'single':
+            # A stream would hold the only server thread forever
+            __stream_max_clients__ = 0
 
         self.started = False
         __on_inside_config_changed__ = self.on_config_changed
 
+        metrics.gauge('pm_dashboard_stream_clients', 'Connected /stream clients', __stream__.count)
+        metrics.gauge('pm_dashboard_write_buffer_points', 'Points waiting to be written', self.get_buffered_points)
+        metrics.gauge('pm_dashboard_sampler_overruns', 'Samples that overran the interval', lambda: self.data_logger.scheduler.overruns)
+        metrics.gauge('pm_dashboard_sampler_skipped', 'Ticks skipped after overruns', lambda: self.data_logger.scheduler.skipped)
+        metrics.gauge('pm_dashboard_query_cache', 'Range query cache counters', _get_cache_stats, ['stat'])
+
+    def get_buffered_points(self):
+        if self.data_logger.write_buffer is None:
+            return 0
+        return len(self.data_logger.write_buffer.queue)
+
     @log_error
     def set_debug_level(self, level):
-        if __db__:
-            __db__.set_debug_level(level)
         self.data_logger.set_debug_level(level)
         self.log.setLevel(level)
 
@@ -506,9 +765,15 @@ class PMDashboard():
 
     @log_error
     def start(self):
-        if __db__:
-            __db__.start()
-        self.server = make_server(__host__, __port__, __app__)
+        self.exporter.start()
+        self.data_logger.start_sampler()
+        # Compress the page and its entrypoints before the first visit
+        threading.Thread(target=__static_assets__.preload, daemon=True).start()
+        self.server = create_server(__host__, __port__, __app__,
+            mode=self.server_mode,
+            max_workers=self.max_workers,
+            timeout=self.request_timeout)
+        self.log.info(f"Dashboard Server mode: {self.server_mode}")
         self.ctx = __app__.app_context()
         self.ctx.push()
         self.thread = threading.Thread(target=self.run, daemon=True)
@@ -516,16 +781,17 @@ class PMDashboard():
 
     @log_error
     def on_config_changed(self, config):
+        global __enable_history__
         if 'data_interval' in config['system']:
             self.data_logger.set_interval(config['system']['data_interval'])
         if 'enable_history' in config['system']:
             if config['system']['enable_history'] == True:
                 if __enable_history__ == False:
-                    self.data_logger.start()
+                    self.start_history()
                 __enable_history__ = True
             else:
                 if __enable_history__ == True:
-                    self.data_logger.stop()
+                    self.data_logger.stop_history()
                 __enable_history__ = False
 
 
@@ -539,9 +805,17 @@ class PMDashboard():
         self.log.info("Dashboard Server start")
         self.started = True
         if __enable_history__:
-            self.data_logger.start()
+            self.start_history()
         self.server.serve_forever()
 
+    @log_error
+    def start_history(self):
+        # Building the backend is cheap, waiting for the database happens
+        # in the background and the server serves live data meanwhile
+        global __db__
+        __db__ = self.data_logger.create_history()
+        threading.Thread(target=self.data_logger.start, daemon=True).start()
+
     @log_error
     def shutdown(self):
         self.server.shutdown()
@@ -551,8 +825,8 @@ class PMDashboard():
         self.log.debug("Stopping Dashboard Server")
         if self.started:
             self.data_logger.stop()
-            if __db__:
-                __db__.close()
+            self.exporter.stop()
+            __stream__.close()
             self.server.shutdown()
             self.server.server_close()
             self.started = False
@@ -0,0 +1,52 @@
+import threading
+from collections import OrderedDict
+
+class QueryCache:
+    # Max values (fields of all cached buckets) kept before evicting
+    MAX_VALUES = 100000
+
+    def __init__(self, max_values=None):
+        self.max_values = max_values or self.MAX_VALUES
+        self.buckets = OrderedDict()
+        self.values = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            point = self.buckets.get(key)
+            if point is None:
+                self.misses += 1
+                return None
+            self.buckets.move_to_end(key)
+            self.hits += 1
+            return point
+
+    def put(self, key, point):
+        with self.lock:
+            old = self.buckets.pop(key, None)
+            if old is not None:
+                self.values -= len(old)
+            self.buckets[key] = point
+            self.values += len(point)
+            while self.values > self.max_values and len(self.buckets) > 0:
+                _, evicted = self.buckets.popitem(last=False)
+                self.values -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+            self.values = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "buckets": len(self.buckets),
+                "values": self.values,
+            }
@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import deque
+
+# What to do with ticks missed while a sample overran its interval
+#   skip: drop them and wait for the next tick on the original grid
+#   coalesce: take one sample right away, then restart the grid from it
+#   catch_up: take the missed samples back to back, up to MAX_CATCH_UP
+OVERRUN_POLICIES = ['skip', 'coalesce', 'catch_up']
+
+class Scheduler:
+    # Max missed ticks sampled back to back under catch_up, older ones are skipped
+    MAX_CATCH_UP = 10
+    # Recent ticks kept for jitter percentiles
+    WINDOW = 300
+    # Seconds the wall clock may move against the monotonic clock before
+    # timestamps are resynced to it, e.g. after an NTP step
+    CLOCK_STEP = 1
+
+    def __init__(self, interval, policy='skip'):
+        if policy not in OVERRUN_POLICIES:
+            raise ValueError(f"Invalid overrun policy: {policy}, choose from {OVERRUN_POLICIES}")
+        self.interval = interval
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.reset()
+
+    def reset(self):
+        # Anchor both clocks on the same instant, timestamps are derived from
+        # the monotonic schedule so they are evenly spaced
+        with self.lock:
+            self.anchor = time.monotonic()
+            self.wall_anchor = time.time_ns()
+            self.next_tick = self.anchor
+            self.stopped = False
+            self.ticks = 0
+            self.overruns = 0
+            self.skipped = 0
+            self.clock_steps = 0
+            self.jitter = deque(maxlen=self.WINDOW)
+            self.durations = deque(maxlen=self.WINDOW)
+            self.max_jitter = 0
+            self.max_duration = 0
+
+    def set_interval(self, interval):
+        self.interval = interval
+        with self.lock:
+            self.next_tick = min(self.next_tick, time.monotonic() + interval)
+        # Wake a sleeping wait() so a shorter interval applies right away
+        self.event.set()
+
+    def set_policy(self, policy):
+        if policy not in OVERRUN_POLICIES:
+            raise ValueError(f"Invalid overrun policy: {policy}, choose from {OVERRUN_POLICIES}")
+        self.policy = policy
+
+    def stop(self):
+        self.stopped = True
+        self.event.set()
+
+    def wait(self):
+        # Sleeps until the next tick is due, returns its monotonic time, or
+        # None once stopped
+        while True:
+            with self.lock:
+                delay = self.next_tick - time.monotonic()
+            if delay <= 0:
+                break
+            self.event.clear()
+            self.event.wait(delay)
+            if self.stopped:
+                return None
+        with self.lock:
+            tick = self.next_tick
+            self.jitter.append(time.monotonic() - tick)
+            self.max_jitter = max(self.max_jitter, self.jitter[-1])
+            self.ticks += 1
+        return tick
+
+    def timestamp(self, tick):
+        # Wall clock time of a tick in ns
+        timestamp = self.wall_anchor + int((tick - self.anchor) * 1e9)
+        now = time.time_ns()
+        elapsed = int((time.monotonic() - tick) * 1e9)
+        if abs(now - elapsed - timestamp) > self.CLOCK_STEP * 1000000000:
+            with self.lock:
+                self.anchor = tick
+                self.wall_anchor = now - elapsed
+                self.clock_steps += 1
+            timestamp = self.wall_anchor
+        return timestamp
+
+    def done(self, tick):
+        # Plans the tick after one that finished sampling
+        now = time.monotonic()
+        with self.lock:
+            self.durations.append(now - tick)
+            self.max_duration = max(self.max_duration, self.durations[-1])
+            next_tick = tick + self.interval
+            if now < next_tick:
+                self.next_tick = next_tick
+                return
+            self.overruns += 1
+            missed = int((now - next_tick) // self.interval) + 1
+            if self.policy == 'coalesce':
+                self.next_tick = now
+                self.skipped += missed - 1
+            elif self.policy == 'catch_up':
+                dropped = max(missed - self.MAX_CATCH_UP, 0)
+                self.next_tick = next_tick + dropped * self.interval
+                self.skipped += dropped
+            else:
+                # Next tick on the grid, keeps the phase
+                self.next_tick = next_tick + missed * self.interval
+                self.skipped += missed
+
+    @staticmethod
+    def percentile(values, p):
+        if len(values) == 0:
+            return None
+        values = sorted(values)
+        return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+    def stats(self):
+        with self.lock:
+            jitter = list(self.jitter)
+            durations = list(self.durations)
+            return {
+                "interval": self.interval,
+                "policy": self.policy,
+                "ticks": self.ticks,
+                "overruns": self.overruns,
+                "skipped": self.skipped,
+                "clock_steps": self.clock_steps,
+                "jitter": {
+                    "p50": self.percentile(jitter, 50),
+                    "p99": self.percentile(jitter, 99),
+                    "max": self.max_jitter,
+                },
+                "duration": {
+                    "p50": self.percentile(durations, 50),
+                    "p99": self.percentile(durations, 99),
+                    "max": self.max_duration,
+                },
+            }
@@ -0,0 +1,82 @@
+import re
+import time
+
+# Flat per-sample measurement written before the normalized schema
+LEGACY_MEASUREMENT = 'history'
+
+# Normalized measurements
+SYSTEM_MEASUREMENT = 'system'
+CPU_MEASUREMENT = 'cpu'
+DISK_MEASUREMENT = 'disk'
+INVENTORY_MEASUREMENT = 'inventory'
+MEASUREMENTS = [SYSTEM_MEASUREMENT, CPU_MEASUREMENT, DISK_MEASUREMENT, INVENTORY_MEASUREMENT]
+
+# Numeric fields that describe the device rather than its load
+STATIC_FIELDS = ['cpu_count', 'cpu_freq_min', 'cpu_freq_max', 'boot_time', 'memory_total']
+INVENTORY_PREFIXES = ['ip_', 'mac_']
+INVENTORY_FIELDS = STATIC_FIELDS + ['network_type']
+
+CPU_KEY = re.compile(r'^cpu_(\d+)_percent$')
+DISK_KEY = re.compile(r'^disk_(.+)_(mounted|total|used|free|percent)$')
+
+def locate(key, value=None):
+    # Where a flat history key lives: (measurement, tags, field)
+    match = CPU_KEY.match(key)
+    if match:
+        return CPU_MEASUREMENT, {'core': match.group(1)}, 'percent'
+    match = DISK_KEY.match(key)
+    if match:
+        return DISK_MEASUREMENT, {'disk': match.group(1)}, match.group(2)
+    if key in INVENTORY_FIELDS or any(key.startswith(prefix) for prefix in INVENTORY_PREFIXES) or isinstance(value, str):
+        return INVENTORY_MEASUREMENT, {}, key
+    return SYSTEM_MEASUREMENT, {}, key
+
+def flat_key(measurement, tags, field):
+    # Inverse of locate
+    if measurement == CPU_MEASUREMENT:
+        return f'cpu_{tags["core"]}_percent'
+    if measurement == DISK_MEASUREMENT:
+        return f'disk_{tags["disk"]}_{field}'
+    return field
+
+class HistorySchema:
+    # Seconds between inventory rewrites even if nothing changed, so it
+    # doesn't expire with the raw retention policy
+    INVENTORY_KEYFRAME = 3600
+
+    def __init__(self):
+        self.inventory = None
+        self.inventory_time = 0
+
+    def split(self, point):
+        # One flat history point to normalized points sharing its time
+        timestamp = point.get('time')
+        if timestamp is None:
+            timestamp = time.time_ns()
+        system = {}
+        series = {}
+        inventory = {}
+        for key, value in point['fields'].items():
+            if value is None:
+                continue
+            measurement, tags, field = locate(key, value)
+            if measurement == SYSTEM_MEASUREMENT:
+                system[field] = value
+            elif measurement == INVENTORY_MEASUREMENT:
+                inventory[field] = value
+            else:
+                tag_key = (measurement, tuple(tags.items()))
+                series.setdefault(tag_key, {})[field] = value
+
+        points = []
+        if len(system) > 0:
+            points.append({"measurement": SYSTEM_MEASUREMENT, "time": timestamp, "fields": system})
+        for (measurement, tags), fields in series.items():
+            points.append({"measurement": measurement, "tags": dict(tags), "time": timestamp, "fields": fields})
+        if len(inventory) > 0:
+            keyframe = timestamp - self.inventory_time >= self.INVENTORY_KEYFRAME * 1000000000
+            if inventory != self.inventory or keyframe:
+                points.append({"measurement": INVENTORY_MEASUREMENT, "time": timestamp, "fields": inventory})
+                self.inventory = inventory
+                self.inventory_time = timestamp
+        return points
@@ -0,0 +1,63 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler, make_server
+
+SERVER_MODES = ['pool', 'threaded', 'single']
+
+class PooledRequestHandler(WSGIRequestHandler):
+    # HTTP/1.1 for keep-alive and chunked streaming responses
+    protocol_version = 'HTTP/1.1'
+
+    def handle_one_request(self):
+        super().handle_one_request()
+        # A kept-alive connection holds its worker, hand it over to
+        # waiting connections instead of starving them
+        if self.server.queued > 0:
+            self.close_connection = True
+
+class PooledWSGIServer(BaseWSGIServer):
+    multithread = True
+
+    def __init__(self, host, port, app, max_workers=16, max_pending=64, timeout=5):
+        # timeout: socket timeout in seconds, closes idle keep-alive
+        # connections and drops clients that stall mid request
+        handler = type('PooledRequestHandler', (PooledRequestHandler,), {'timeout': timeout})
+        super().__init__(host, port, app, handler=handler)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pm_dashboard_http')
+        self.slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self.queued = 0
+        self.queued_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            # Refuse instead of queueing connections without bound
+            self.shutdown_request(request)
+            return
+        with self.queued_lock:
+            self.queued += 1
+        self.executor.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        with self.queued_lock:
+            self.queued -= 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+def create_server(host, port, app, mode='pool', max_workers=16, timeout=5):
+    if mode == 'pool':
+        return PooledWSGIServer(host, port, app, max_workers=max_workers, timeout=timeout)
+    elif mode == 'threaded':
+        return make_server(host, port, app, threaded=True)
+    elif mode == 'single':
+        return make_server(host, port, app)
+    raise ValueError(f"Invalid server mode: {mode}, available modes: {SERVER_MODES}")
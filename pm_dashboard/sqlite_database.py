@@ -0,0 +1,469 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .storage import WRITE_SECONDS, QUERY_SECONDS, fill_points, is_exact, percentile, percentile_value, time_range_rows, to_columnar
+from .schema import LEGACY_MEASUREMENT
+
+class SQLiteDatabase:
+    # Embedded alternative to Database, one SQLite file in WAL mode and no
+    # external daemon. Each measurement is a table with one row per point,
+    # keyed on time in ns, and one column per field.
+
+    # Days raw samples are kept
+    RAW_RETENTION_DAYS = 7
+    # Rollup tiers: (name, resolution in seconds, retention in days, None for forever)
+    ROLLUP_TIERS = [
+        ('rollup_1m', 60, 90),
+        ('rollup_1h', 3600, None),
+    ]
+    # Aggregates stored per field in rollup tiers, as <function>_<field>
+    ROLLUP_FUNCTIONS = {
+        'mean': 'avg',
+        'min': 'min',
+        'max': 'max',
+        'sum': 'sum',
+        'count': 'count',
+    }
+    # How a query function is computed from the stored rollup aggregates
+    ROLLUP_QUERY_FUNCTIONS = {
+        'mean': ('avg', 'mean'),
+        'min': ('min', 'min'),
+        'max': ('max', 'max'),
+        'sum': ('sum', 'sum'),
+        'count': ('sum', 'count'),
+        'last': (None, 'mean'),
+        'percentile': (None, 'mean'),
+    }
+    NUMERIC_TYPES = ['REAL', 'INTEGER']
+    # Functions that also apply to TEXT columns, the rest leave them null
+    TEXT_FUNCTIONS = ['count', 'last']
+    QUERY_FUNCTIONS = {
+        'mean': 'avg',
+        'sum': 'sum',
+        'min': 'min',
+        'max': 'max',
+        'count': 'count',
+    }
+    # Seconds between rollup and retention passes
+    MAINTENANCE_INTERVAL = 60
+    # Seconds late points may still arrive, newer buckets aren't rolled up
+    SETTLE_TIME = 10
+    # Points read per query by iter_points
+    EXPORT_CHUNK = 3600
+
+    def __init__(self, database, path=None, get_logger=None):
+        if get_logger is None:
+            get_logger = logging.getLogger
+        self.log = get_logger(__name__)
+        self.database = database
+        if path is None:
+            path = f'/var/lib/pm_dashboard/{database}.db'
+        self.path = path
+
+        self.conn = None
+        self.lock = threading.Lock()
+        self.columns = {}
+        self.maintained = 0
+        # Seconds a history field may go unwritten while unchanged, reads
+        # fill it back in for that long. None when every field is written.
+        self.fill_window = None
+        # Returns the last written values as [(time ns, fields)], so reads
+        # don't have to look for them in the database
+        self.fill_seed = None
+        # fill_fields(field) is True for fields written only on change,
+        # None to fill every field
+        self.fill_fields = None
+
+    def set_debug_level(self, level):
+        self.log.info(f"Setting debug level to {level}")
+        self.log.setLevel(level)
+
+    def start(self):
+        if self.conn is not None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+        self.conn.commit()
+        self.log.info(f"SQLite database '{self.path}' is ready")
+
+    def is_ready(self):
+        return self.conn is not None
+
+    def probe(self):
+        return self.is_ready()
+
+    def get_state(self):
+        return {
+            "state": 'ready' if self.is_ready() else 'unknown',
+            "age": 0,
+        }
+
+    def get_cache_stats(self):
+        return {}
+
+    def invalidate_cache(self):
+        pass
+
+    @staticmethod
+    def quote(name):
+        return '"' + name.replace('"', '""') + '"'
+
+    @staticmethod
+    def table_name(measurement, tier=None):
+        if tier is None:
+            return measurement
+        return f'{measurement}__{tier}'
+
+    def _table_columns(self, table):
+        rows = self.conn.execute(f'PRAGMA table_info({self.quote(table)})').fetchall()
+        return {row[1]: row[2] for row in rows}
+
+    def _ensure_columns(self, table, fields):
+        columns = self.columns.get(table)
+        if columns is None:
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS {self.quote(table)} (time INTEGER PRIMARY KEY)')
+            columns = self._table_columns(table)
+            self.columns[table] = columns
+        for field, value in fields.items():
+            if field in columns:
+                continue
+            if isinstance(value, str):
+                column_type = 'TEXT'
+            elif isinstance(value, float):
+                column_type = 'REAL'
+            else:
+                column_type = 'INTEGER'
+            self.conn.execute(f'ALTER TABLE {self.quote(table)} ADD COLUMN {self.quote(field)} {column_type}')
+            columns[field] = column_type
+
+    def set(self, measurement, data):
+        json_body = [
+            {
+                "measurement": measurement,
+                "time": time.time_ns(),
+                "fields": data
+            }
+        ]
+        status, msg = self.write_points(json_body)
+        if not status:
+            return False, msg
+        return True, json_body
+
+    def write_points(self, points, history_schema=None):
+        # history_schema is for InfluxDB's normalized schema, every field
+        # is stored as is here
+        if not self.is_ready():
+            return False, 'Database is not ready'
+        try:
+            with WRITE_SECONDS.time('sqlite'), self.lock:
+                with self.conn:
+                    for point in points:
+                        table = self.table_name(point['measurement'])
+                        fields = {key: value for key, value in point['fields'].items() if value is not None}
+                        self._ensure_columns(table, fields)
+                        columns = ['time'] + list(fields)
+                        names = ','.join(self.quote(column) for column in columns)
+                        values = ','.join('?' for _ in columns)
+                        updates = ','.join(f'{self.quote(field)}=excluded.{self.quote(field)}' for field in fields)
+                        upsert = f' ON CONFLICT(time) DO UPDATE SET {updates}' if len(fields) > 0 else ' ON CONFLICT(time) DO NOTHING'
+                        timestamp = point.get('time') or time.time_ns()
+                        self.conn.execute(f'INSERT INTO {self.quote(table)} ({names}) VALUES ({values}){upsert}',
+                            [timestamp] + list(fields.values()))
+            self._maintain()
+            return True, None
+        except sqlite3.Error as e:
+            return False, str(e)
+
+    def _measurements(self):
+        rows = self.conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name != 'meta'").fetchall()
+        return [row[0] for row in rows if '__' not in row[0]]
+
+    def _get_meta(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def _maintain(self):
+        # Local rollup job, stands in for InfluxDB continuous queries
+        now = time.monotonic()
+        if now - self.maintained < self.MAINTENANCE_INTERVAL:
+            return
+        self.maintained = now
+        try:
+            with self.lock:
+                with self.conn:
+                    for measurement in self._measurements():
+                        self._rollup(measurement)
+        except sqlite3.Error as e:
+            self.log.error(f"Failed to roll up history: {e}")
+
+    def _rollup(self, measurement):
+        now = time.time_ns()
+        columns = self._table_columns(measurement)
+        numeric = [column for column, column_type in columns.items() if column != 'time' and column_type in self.NUMERIC_TYPES]
+        first = self.conn.execute(f'SELECT min(time) FROM {self.quote(measurement)}').fetchone()[0]
+        if first is None:
+            return
+        rolled_up = []
+        for tier, resolution, days in self.ROLLUP_TIERS:
+            resolution_ns = resolution * 1000000000
+            table = self.table_name(measurement, tier)
+            watermark_key = f'{table}:watermark'
+            watermark = self._get_meta(watermark_key, first // resolution_ns * resolution_ns)
+            until = (now - self.SETTLE_TIME * 1000000000) // resolution_ns * resolution_ns
+            if until > watermark and len(numeric) > 0:
+                self._rollup_tier(measurement, tier, resolution_ns, numeric, watermark, until)
+                self._set_meta(watermark_key, until)
+                watermark = until
+            rolled_up.append(watermark)
+            if days is not None and len(self._table_columns(table)) > 0:
+                self.conn.execute(f'DELETE FROM {self.quote(table)} WHERE time < ?', (now - days * 86400 * 1000000000,))
+        # Raw data expires, but never before it is rolled up
+        expire = min([now - self.RAW_RETENTION_DAYS * 86400 * 1000000000] + rolled_up)
+        self.conn.execute(f'DELETE FROM {self.quote(measurement)} WHERE time < ?', (expire,))
+
+    def _rollup_tier(self, measurement, tier, resolution_ns, numeric, start_time, end_time):
+        table = self.table_name(measurement, tier)
+        fields = {f'{stored}_{column}': 0.0 for column in numeric for stored in self.ROLLUP_FUNCTIONS}
+        self._ensure_columns(table, fields)
+        names = ','.join(self.quote(field) for field in fields)
+        selects = ','.join(f'{function}({self.quote(column)})' for column in numeric for function in self.ROLLUP_FUNCTIONS.values())
+        self.conn.execute(f'INSERT OR REPLACE INTO {self.quote(table)} (time,{names}) '
+            f'SELECT time / {resolution_ns} * {resolution_ns},{selects} FROM {self.quote(measurement)} '
+            f'WHERE time >= ? AND time < ? GROUP BY time / {resolution_ns}', (start_time, end_time))
+
+    def rollup_range(self, start_time, end_time):
+        # Rolls up raw points written behind the rollup watermark, like
+        # imported history. Times in ns. Newer buckets are left to _maintain.
+        with self.lock:
+            with self.conn:
+                for measurement in self._measurements():
+                    columns = self._table_columns(measurement)
+                    numeric = [column for column, column_type in columns.items() if column != 'time' and column_type in self.NUMERIC_TYPES]
+                    if len(numeric) == 0:
+                        continue
+                    for tier, resolution, days in self.ROLLUP_TIERS:
+                        resolution_ns = resolution * 1000000000
+                        watermark = self._get_meta(f'{self.table_name(measurement, tier)}:watermark')
+                        if watermark is None:
+                            continue
+                        start = int(start_time) // resolution_ns * resolution_ns
+                        end = min(-(-(int(end_time) + 1) // resolution_ns) * resolution_ns, watermark)
+                        if end > start:
+                            self._rollup_tier(measurement, tier, resolution_ns, numeric, start, end)
+
+    @staticmethod
+    def format_time(value):
+        # Epoch ns to the RFC3339 form InfluxDB returns
+        seconds, ns = divmod(value, 1000000000)
+        fraction = f'{ns:09d}'.rstrip('0')
+        if fraction != '':
+            fraction = '.' + fraction
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)) + fraction + 'Z'
+
+    def get(self, measurement, key="*", n=1):
+        if not self.is_ready():
+            self.log.error('Database is not ready')
+            return []
+        with self.lock:
+            columns = self._table_columns(measurement)
+            if len(columns) == 0:
+                rows = []
+                keys = []
+            else:
+                keys = [column for column in columns if column != 'time'] if key == "*" else key.split(",")
+                select = ','.join(self.quote(k) if k in columns else 'NULL' for k in keys)
+                rows = self.conn.execute(f'SELECT time,{select} FROM {self.quote(measurement)} ORDER BY time DESC LIMIT ?', (int(n),)).fetchall()
+        result = [dict(zip(['time'] + keys, [self.format_time(row[0])] + list(row[1:]))) for row in rows]
+        if measurement == LEGACY_MEASUREMENT and self.fill_window is not None and len(result) > 0:
+            # Fields written only on change, from earlier rows and the last written values
+            seed = [] if self.fill_seed is None else self.fill_seed()
+            result = fill_points(result, seed, None if key == "*" else keys, self.fill_window * 1000000000, self.fill_fields)
+        if n == 1:
+            if len(result) == 0:
+                self.log.warning(f"No data found for measurement {measurement}")
+                result = None
+            else:
+                result = result[0]
+                if key != "*" and key != "time" and "," not in key:
+                    result = result[key]
+        return result
+
+    def get_data_by_time_range(self, measurement, start_time, end_time, keys="*", function="mean", max_size=300):
+        columns, rows = self.get_rows_by_time_range(measurement, start_time, end_time, keys, function, max_size)
+        return self.rows_to_points(columns, rows)
+
+    def rows_to_points(self, columns, rows):
+        return [dict(zip(columns, [self.format_time(row[0] * 1000000000)] + row[1:])) for row in rows]
+
+    def get_columns_by_time_range(self, measurement, start_time, end_time, keys="*", function="mean", max_size=300, time_delta=False, precision=None):
+        columns, rows = self.get_rows_by_time_range(measurement, start_time, end_time, keys, function, max_size)
+        return to_columnar(columns, rows, time_delta, precision)
+
+    def get_rows_by_time_range(self, measurement, start_time, end_time, keys="*", function="mean", max_size=300):
+        if not self.is_ready():
+            self.log.error('Database is not ready')
+            return [], []
+        try:
+            return time_range_rows(self, measurement, start_time, end_time, keys, function, max_size)
+        except ValueError as e:
+            self.log.error(str(e))
+            return [], []
+
+    def bucket_rows(self, measurement, start_time, end_time, keys, bases, interval):
+        # [time] + bases per key for every bucket in the range, empty ones
+        # as nulls like InfluxDB
+        interval_ns = interval * 1000000000
+        with QUERY_SECONDS.time('sqlite'), self.lock:
+            tier = self._choose_tier(start_time, interval, any(is_exact(function) for function in bases))
+            buckets = {}
+            boundary = start_time
+            if tier is not None:
+                # Rolled up buckets from the tier, the rest from raw data
+                watermark = self._get_meta(f'{self.table_name(measurement, tier)}:watermark', start_time)
+                boundary = max(min(watermark // interval_ns * interval_ns, end_time + 1), start_time)
+                if boundary > start_time:
+                    self._query_buckets(buckets, measurement, tier, start_time, boundary - 1, keys, bases, interval_ns)
+            if boundary <= end_time:
+                self._query_buckets(buckets, measurement, None, boundary, end_time, keys, bases, interval_ns)
+
+        rows = []
+        bucket = start_time // interval_ns * interval_ns
+        if len(buckets) > 0:
+            while bucket <= end_time:
+                rows.append([bucket // 1000000000] + buckets.get(bucket, [None] * (len(keys) * len(bases))))
+                bucket += interval_ns
+        return rows
+
+    def _choose_tier(self, start_time, interval, exact=False):
+        # exact skips tiers while raw data is still kept
+        raw_start = time.time_ns() - self.RAW_RETENTION_DAYS * 86400 * 1000000000
+        chosen = None
+        for name, resolution, days in self.ROLLUP_TIERS:
+            if (resolution <= interval and not exact) or start_time < raw_start:
+                chosen = name
+                if days is not None:
+                    raw_start = time.time_ns() - days * 86400 * 1000000000
+        return chosen
+
+    def _query_buckets(self, buckets, measurement, tier, start_time, end_time, keys, functions, interval_ns):
+        # Fills buckets[time] with functions per key. Plain aggregates come
+        # from one GROUP BY query, last and percentiles per key.
+        table = self.table_name(measurement, tier)
+        columns = self._table_columns(table)
+        if len(columns) == 0:
+            return
+        width = len(keys) * len(functions)
+        selects = []
+        positions = []
+        per_key = []
+        for k, key in enumerate(keys):
+            for f, function in enumerate(functions):
+                position = k * len(functions) + f
+                name = 'percentile' if function.startswith('percentile_') else function
+                if tier is None:
+                    column = key
+                    query_function = self.QUERY_FUNCTIONS.get(name)
+                else:
+                    query_function, stored_function = self.ROLLUP_QUERY_FUNCTIONS[name]
+                    column = f'{stored_function}_{key}'
+                if column not in columns:
+                    continue
+                if columns[column] not in self.NUMERIC_TYPES and name not in self.TEXT_FUNCTIONS:
+                    # Like InfluxDB, no averages of strings
+                    continue
+                if query_function is None:
+                    per_key.append((position, function, column))
+                else:
+                    selects.append(f'{query_function}({self.quote(column)})')
+                    positions.append(position)
+        bucket = f'time / {interval_ns} * {interval_ns}'
+        if len(selects) > 0:
+            query = (f'SELECT {bucket},{",".join(selects)} FROM {self.quote(table)} '
+                f'WHERE time >= ? AND time <= ? GROUP BY time / {interval_ns}')
+            for row in self.conn.execute(query, (start_time, end_time)):
+                values = buckets.setdefault(row[0], [None] * width)
+                for position, value in zip(positions, row[1:]):
+                    values[position] = value
+        for position, function, column in per_key:
+            where = f'WHERE time >= ? AND time <= ? AND {self.quote(column)} IS NOT NULL'
+            if function == 'last':
+                # With a single max() SQLite takes the other columns from
+                # the row holding the max
+                query = f'SELECT {bucket},{self.quote(column)},max(time) FROM {self.quote(table)} {where} GROUP BY time / {interval_ns}'
+                for row in self.conn.execute(query, (start_time, end_time)):
+                    buckets.setdefault(row[0], [None] * width)[position] = row[1]
+                continue
+            n = percentile_value(function)
+            current = None
+            values = []
+            query = f'SELECT {bucket},{self.quote(column)} FROM {self.quote(table)} {where} ORDER BY time'
+            for row in self.conn.execute(query, (start_time, end_time)):
+                if row[0] != current:
+                    if current is not None:
+                        buckets.setdefault(current, [None] * width)[position] = percentile(values, n)
+                    current = row[0]
+                    values = []
+                values.append(row[1])
+            if current is not None:
+                buckets.setdefault(current, [None] * width)[position] = percentile(values, n)
+
+    def field_keys(self, measurement, numeric=False):
+        # Every field ever written to measurement, numeric ones only with numeric
+        with self.lock:
+            columns = self._table_columns(measurement)
+        return [column for column, column_type in columns.items() if column != 'time' and (not numeric or column_type in self.NUMERIC_TYPES)]
+
+    def iter_points(self, measurement, start_time, end_time, keys="*"):
+        # Raw points as (time ns, fields) in time order, paged on time so
+        # memory doesn't grow with the range
+        if not self.is_ready():
+            raise ConnectionError('Database is not ready')
+        start_time = int(start_time)
+        end_time = int(end_time)
+        while True:
+            with self.lock:
+                columns = self._table_columns(measurement)
+                if len(columns) == 0:
+                    return
+                names = [column for column in columns if column != 'time'] if keys == "*" else [key for key in keys.split(",") if key in columns]
+                select = ','.join(['time'] + [self.quote(name) for name in names])
+                rows = self.conn.execute(f'SELECT {select} FROM {self.quote(measurement)} WHERE time >= ? AND time <= ? ORDER BY time LIMIT ?',
+                    (start_time, end_time, self.EXPORT_CHUNK)).fetchall()
+            for row in rows:
+                fields = {name: value for name, value in zip(names, row[1:]) if value is not None}
+                if len(fields) > 0:
+                    yield row[0], fields
+            if len(rows) < self.EXPORT_CHUNK:
+                return
+            start_time = rows[-1][0] + 1
+
+    def clear_measurement(self, measurement):
+        self.log.warning(f"Clearing database: {self.database}")
+        if not self.is_ready():
+            self.log.error('Database is not ready')
+            return False
+        with self.lock:
+            with self.conn:
+                tables = [measurement] + [self.table_name(measurement, tier) for tier, _, _ in self.ROLLUP_TIERS]
+                for table in tables:
+                    self.conn.execute(f'DROP TABLE IF EXISTS {self.quote(table)}')
+                    self.conn.execute('DELETE FROM meta WHERE key = ?', (f'{table}:watermark',))
+                    self.columns.pop(table, None)
+        self.log.info(f"Database '{self.database}' cleared successfully")
+        return True
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+        self.log.info("Database closed")
@@ -0,0 +1,103 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import re
+import threading
+from os import path
+
+from flask import Response, request
+from werkzeug.security import safe_join
+
+# Build output with a content hash in the name, e.g. main.345e5e12.js
+HASHED_NAME = re.compile(r'\.[0-9a-f]{8}\.')
+COMPRESSIBLE_TYPES = ['text/', 'application/javascript', 'application/json', 'image/svg+xml', 'image/x-icon', 'image/vnd.microsoft.icon']
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'no-cache'
+
+class StaticAsset:
+    def __init__(self, file_path, immutable=False):
+        with open(file_path, 'rb') as f:
+            self.content = f.read()
+        self.mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        self.etag = hashlib.sha1(self.content).hexdigest()[:16]
+        self.immutable = immutable
+        self.encodings = {}
+        if any(self.mimetype.startswith(t) for t in COMPRESSIBLE_TYPES):
+            self.compress(file_path)
+
+    def compress(self, file_path):
+        # Prefer variants shipped next to the file, build missing ones here
+        for encoding, suffix in [('br', '.br'), ('gzip', '.gz')]:
+            if path.exists(file_path + suffix):
+                with open(file_path + suffix, 'rb') as f:
+                    self.encodings[encoding] = f.read()
+        if 'gzip' not in self.encodings:
+            self.encodings['gzip'] = gzip.compress(self.content, compresslevel=9, mtime=0)
+        if 'br' not in self.encodings:
+            try:
+                import brotli
+                self.encodings['br'] = brotli.compress(self.content)
+            except ImportError:
+                pass
+        for encoding in list(self.encodings):
+            if len(self.encodings[encoding]) >= len(self.content):
+                del self.encodings[encoding]
+
+class StaticAssets:
+    def __init__(self, root):
+        self.root = root
+        self.assets = {}
+        self.lock = threading.Lock()
+        self.hashed = set()
+        self.entrypoints = []
+        self.load_manifest()
+
+    def load_manifest(self):
+        manifest_path = path.join(self.root, 'asset-manifest.json')
+        if not path.exists(manifest_path):
+            return
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        for file in manifest.get('files', {}).values():
+            file = path.normpath(file)
+            if HASHED_NAME.search(path.basename(file)):
+                self.hashed.add(file)
+        self.entrypoints = [path.normpath(file) for file in manifest.get('entrypoints', [])]
+
+    def preload(self):
+        for name in ['index.html'] + self.entrypoints:
+            self.get(name)
+
+    def get(self, name):
+        name = path.normpath(name)
+        asset = self.assets.get(name)
+        if asset is not None:
+            return asset
+        file_path = safe_join(self.root, name)
+        if file_path is None or not path.isfile(file_path):
+            return None
+        with self.lock:
+            if name not in self.assets:
+                immutable = name in self.hashed or HASHED_NAME.search(path.basename(name)) is not None
+                self.assets[name] = StaticAsset(file_path, immutable)
+            return self.assets[name]
+
+    def response(self, name):
+        asset = self.get(name)
+        if asset is None:
+            return None
+        headers = {
+            'ETag': f'"{asset.etag}"',
+            'Cache-Control': IMMUTABLE_CACHE if asset.immutable else REVALIDATE_CACHE,
+            'Vary': 'Accept-Encoding',
+        }
+        if request.if_none_match.contains(asset.etag):
+            return Response(status=304, headers=headers)
+        content = asset.content
+        for encoding in ['br', 'gzip']:
+            if encoding in asset.encodings and request.accept_encodings[encoding]:
+                content = asset.encodings[encoding]
+                headers['Content-Encoding'] = encoding
+                break
+        return Response(content, mimetype=asset.mimetype, headers=headers)
@@ -0,0 +1,227 @@
+import calendar
+import re
+import time
+from math import floor
+
+from . import metrics
+from .schema import LEGACY_MEASUREMENT
+
+# History storage backends, each imported on first use so a dashboard
+# without history never loads the InfluxDB client stack
+BACKENDS = ['influxdb', 'sqlite']
+# Aggregates get_rows_by_time_range accepts, plus percentile(N). Several
+# can be asked for at once, comma separated, one column each as
+# <function>_<key>
+FUNCTIONS = ['mean', 'sum', 'min', 'max', 'count', 'last', 'spread', 'derivative', 'non_negative_derivative']
+# Shorthands for several functions
+FUNCTION_SETS = {
+    'envelope': ['min', 'mean', 'max'],
+}
+# Computed after the query from the aggregates they need, so they work the
+# same on every backend and rollup tier
+DERIVED_FUNCTIONS = {
+    'spread': ['min', 'max'],
+    'derivative': ['mean'],
+    'non_negative_derivative': ['mean'],
+}
+# Aggregates rollups can only approximate, read from raw data while it's kept
+EXACT_FUNCTIONS = ['last', 'percentile']
+PERCENTILE = re.compile(r'^percentile[(_](\d+(?:\.\d+)?)\)?$')
+
+WRITE_SECONDS = metrics.histogram('pm_dashboard_db_write_seconds', 'Time to write a batch of points', ['backend'])
+QUERY_SECONDS = metrics.histogram('pm_dashboard_db_query_seconds', 'Database query latency', ['backend'])
+
+def to_columnar(columns, rows, time_delta=False, precision=None):
+    # (columns, rows) from get_rows_by_time_range to {"time": [...],
+    # "values": {key: [...]}}, times optionally as deltas from the previous one
+    times = [row[0] for row in rows]
+    if time_delta:
+        times = [t - times[i - 1] if i > 0 else t for i, t in enumerate(times)]
+    values = {}
+    for i, column in enumerate(columns[1:], 1):
+        column_values = [row[i] for row in rows]
+        if precision is not None:
+            column_values = [round(v, precision) if isinstance(v, float) else v for v in column_values]
+        values[column] = column_values
+    return {"time": times, "values": values, "time_delta": time_delta}
+
+def parse_functions(function):
+    # 'max', 'percentile(95)', 'min,max' or 'envelope' to a list of names,
+    # percentiles as percentile_<N>. Raises ValueError.
+    functions = []
+    for name in function.split(","):
+        name = name.strip()
+        match = PERCENTILE.match(name)
+        if match is not None:
+            n = float(match.group(1))
+            if n > 100:
+                raise ValueError(f"Invalid percentile: {match.group(1)}, must be between 0 and 100")
+            name = f'percentile_{match.group(1)}'
+            names = [name]
+        elif name in FUNCTION_SETS:
+            names = FUNCTION_SETS[name]
+        elif name in FUNCTIONS:
+            names = [name]
+        else:
+            raise ValueError(f"Invalid function: {name}, choose from {FUNCTIONS + list(FUNCTION_SETS)} or percentile(N)")
+        functions.extend(name for name in names if name not in functions)
+    return functions
+
+def base_functions(functions):
+    # Aggregates the database computes for functions
+    bases = []
+    for function in functions:
+        for base in DERIVED_FUNCTIONS.get(function, [function]):
+            if base not in bases:
+                bases.append(base)
+    return bases
+
+def is_exact(function):
+    return function.split('_')[0] in EXACT_FUNCTIONS
+
+def percentile_value(function):
+    # percentile_95 to 95.0
+    return float(function[len('percentile_'):])
+
+def percentile(values, n):
+    # Nearest rank, like InfluxDB's percentile()
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    i = min(max(int(len(values) * n / 100 + 0.5) - 1, 0), len(values) - 1)
+    return values[i]
+
+def output_columns(keys, functions):
+    if len(functions) == 1:
+        return ['time'] + keys
+    return ['time'] + [f'{function}_{key}' for key in keys for function in functions]
+
+def derive_rows(rows, key_count, functions, bases):
+    # Rows of [time] + bases per key to [time] + functions per key.
+    # Derivatives are per second against the previous non-null bucket.
+    if functions == bases:
+        return rows
+    index = {base: i for i, base in enumerate(bases)}
+    width = len(bases)
+    previous = [None] * key_count
+    result = []
+    for row in rows:
+        values = [row[0]]
+        for k in range(key_count):
+            offset = 1 + k * width
+            mean = row[offset + index['mean']] if 'mean' in index else None
+            for function in functions:
+                if function == 'spread':
+                    low = row[offset + index['min']]
+                    high = row[offset + index['max']]
+                    values.append(None if low is None or high is None else high - low)
+                elif function in ['derivative', 'non_negative_derivative']:
+                    value = None
+                    if mean is not None and previous[k] is not None:
+                        value = (mean - previous[k][1]) / (row[0] - previous[k][0])
+                        if function == 'non_negative_derivative' and value < 0:
+                            value = None
+                    values.append(value)
+                else:
+                    values.append(row[offset + index[function]])
+            if mean is not None:
+                previous[k] = (row[0], mean)
+        result.append(values)
+    return result
+
+def parse_time(value):
+    # RFC3339 time as InfluxDB returns it to epoch ns
+    seconds, _, fraction = value.rstrip('Z').partition('.')
+    return calendar.timegm(time.strptime(seconds, '%Y-%m-%dT%H:%M:%S')) * 1000000000 + int(fraction[:9].ljust(9, '0'))
+
+def fill_rows(rows, max_age, columns):
+    # Null cells in columns of [time, ...] rows take the last value of
+    # their column, for at most max_age seconds, so fields written only on
+    # change read back on every row while real gaps stay gaps
+    held = {}
+    result = []
+    for row in rows:
+        filled = list(row)
+        for i in columns:
+            if row[i] is not None:
+                held[i] = (row[0], row[i])
+            elif i in held and row[0] - held[i][0] <= max_age:
+                filled[i] = held[i][1]
+        result.append(filled)
+    return result
+
+def fill_points(points, seed, keys, max_age, fields=None):
+    # Same for get(): points newest first with RFC3339 times, seed known
+    # writes as (time ns, fields), oldest first, each applied from its own
+    # time on. keys None fills every field, fields(field) False keeps a
+    # field's nulls. max_age in ns.
+    held = {}
+
+    def hold(timestamp, fields):
+        for field, value in fields.items():
+            if field not in held or held[field][0] <= timestamp:
+                held[field] = (timestamp, value)
+
+    seed = list(seed)
+    i = 0
+    for point in reversed(points):
+        timestamp = parse_time(point['time'])
+        while i < len(seed) and seed[i][0] <= timestamp:
+            hold(*seed[i])
+            i += 1
+        written = {field: value for field, value in point.items() if field != 'time' and value is not None}
+        for field, (held_time, value) in held.items():
+            if field not in written and (keys is None or field in keys) and (fields is None or fields(field)) \
+                    and timestamp - held_time <= max_age:
+                point[field] = value
+        hold(timestamp, written)
+    return points
+
+def time_range_rows(db, measurement, start_time, end_time, keys="*", function="mean", max_size=300):
+    # get_rows_by_time_range for both backends: (columns, rows) with
+    # columns[0] "time" in epoch seconds. db.bucket_rows(measurement,
+    # start, end, keys, bases, interval) returns [time] + bases per key for
+    # each bucket, the rest is done here. Raises ValueError.
+    functions = parse_functions(function)
+    bases = base_functions(functions)
+    start_time = int(start_time)
+    end_time = int(end_time)
+    duration_in_seconds = (end_time - start_time) / 1000000000
+    interval = 1
+    if duration_in_seconds > max_size:
+        interval = floor(duration_in_seconds / max_size)
+    interval_ns = interval * 1000000000
+    first_bucket = start_time // interval_ns
+    if 'mean' in bases and any(function in DERIVED_FUNCTIONS for function in functions):
+        # One bucket before the range, for the first derivative
+        start_time -= interval_ns
+    fill = measurement == LEGACY_MEASUREMENT and db.fill_window is not None
+    if fill:
+        # From a keyframe before the range, so fields written only on
+        # change have a value to carry in
+        start_time -= -(-db.fill_window // interval) * interval_ns
+
+    keys = db.field_keys(measurement, numeric=True) if keys == "*" else keys.split(",")
+    if len(keys) == 0:
+        return output_columns(keys, functions), []
+    rows = db.bucket_rows(measurement, start_time, end_time, keys, bases, interval)
+    if fill:
+        # Only fields the deduplicator drops, a null in any other is a gap
+        width = len(bases)
+        columns = [1 + k * width + j for k, key in enumerate(keys)
+                   if db.fill_fields is None or db.fill_fields(key) for j in range(width)]
+        rows = fill_rows(rows, db.fill_window + interval, columns)
+    # Derived from every row, the bucket before the range included, so
+    # the first derivative has a previous value
+    rows = derive_rows(rows, len(keys), functions, bases)
+    rows = [row for row in rows if row[0] // interval >= first_bucket]
+    return output_columns(keys, functions), rows
+
+def create_database(database, backend='influxdb', path=None, get_logger=None):
+    if backend == 'sqlite':
+        from .sqlite_database import SQLiteDatabase
+        return SQLiteDatabase(database, path=path, get_logger=get_logger)
+    if backend != 'influxdb':
+        raise ValueError(f"Unknown database backend: {backend}, choose from {BACKENDS}")
+    from .database import Database
+    return Database(database, get_logger=get_logger)
@@ -0,0 +1,103 @@
+import json
+import queue
+import threading
+from fnmatch import fnmatchcase
+
+class SampleStream:
+    # Samples queued per client before the oldest is dropped
+    QUEUE_SIZE = 10
+
+    def __init__(self):
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def publish(self, timestamp, data):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(timestamp, data)
+
+    def subscribe(self, keys=None, delta=False):
+        subscriber = StreamSubscriber(keys, delta, self.QUEUE_SIZE)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def count(self):
+        with self.lock:
+            return len(self.subscribers)
+
+    def close(self):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.close()
+
+class StreamSubscriber:
+    def __init__(self, keys=None, delta=False, queue_size=10):
+        # keys: list of field names or glob patterns like disk_*_percent
+        self.keys = keys
+        self.delta = delta
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.matches = {}
+        self.last = None
+        self.closed = False
+
+    def put(self, timestamp, data):
+        while True:
+            try:
+                self.queue.put_nowait((timestamp, data))
+                return
+            except queue.Full:
+                # Slow client, drop the oldest sample
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        self.closed = True
+        # Wake up the reader so it notices
+        self.put(None, None)
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def match(self, key):
+        if self.keys is None:
+            return True
+        if key not in self.matches:
+            self.matches[key] = any(fnmatchcase(key, pattern) for pattern in self.keys)
+        return self.matches[key]
+
+    def encode(self, timestamp, data):
+        # Returns the message to send, or None if nothing changed
+        data = {key: value for key, value in data.items() if self.match(key)}
+        message = {"time": timestamp // 1000000}
+        if not self.delta or self.last is None:
+            message["data"] = data
+        else:
+            changed = {key: value for key, value in data.items() if key not in self.last or self.last[key] != value}
+            for key in self.last:
+                if key not in data:
+                    changed[key] = None
+            if len(changed) == 0:
+                self.last = data
+                return None
+            message["data"] = changed
+            message["delta"] = True
+        self.last = data
+        return message
+
+    def event(self, timestamp, data):
+        message = self.encode(timestamp, data)
+        if message is None:
+            return None
+        return f"event: sample\ndata: {json.dumps(message)}\n\n"
@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from .utils import log_error
+
+class WriteBuffer:
+    # Flush when this many points are buffered
+    FLUSH_SIZE = 60
+    # Flush when the oldest buffered point is this old, in seconds
+    FLUSH_AGE = 2
+    # Max points held in memory before spilling to the journal
+    MAX_SIZE = 1000
+    # Max journal size in bytes, newer points are dropped once reached
+    MAX_JOURNAL_SIZE = 20 * 1024 * 1024
+    # Points replayed from the journal per write
+    REPLAY_BATCH_SIZE = 500
+
+    @log_error
+    def __init__(self, db, journal_path=None, flush_size=None, flush_age=None, max_size=None, max_journal_size=None, get_logger=None):
+        if get_logger is None:
+            get_logger = logging.getLogger
+        self.log = get_logger(__name__)
+
+        self.db = db
+        self.journal_path = journal_path
+        self.flush_size = flush_size or self.FLUSH_SIZE
+        self.flush_age = flush_age or self.FLUSH_AGE
+        self.max_size = max_size or self.MAX_SIZE
+        self.max_journal_size = max_journal_size or self.MAX_JOURNAL_SIZE
+
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.journal_lock = threading.Lock()
+        self.thread = None
+        self.running = False
+
+    @log_error
+    def set_debug_level(self, level):
+        self.log.setLevel(level)
+
+    @log_error
+    def push(self, measurement, fields, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time_ns()
+        point = {
+            "measurement": measurement,
+            "time": timestamp,
+            "fields": fields,
+        }
+        with self.lock:
+            self.queue.append(point)
+            size = len(self.queue)
+            if size >= self.max_size:
+                spill = list(self.queue)
+                self.queue.clear()
+            else:
+                spill = None
+        if spill is not None:
+            self.log.warning(f"Write buffer full, spilling {len(spill)} points to journal")
+            self._journal_write(spill)
+        elif size >= self.flush_size:
+            self.event.set()
+
+    def _take(self):
+        with self.lock:
+            points = list(self.queue)
+            self.queue.clear()
+        return points
+
+    def _oldest_age(self):
+        with self.lock:
+            if len(self.queue) == 0:
+                return None
+            oldest = self.queue[0]['time']
+        return time.time() - oldest / 1e9
+
+    @log_error
+    def flush(self):
+        points = self._take()
+        if len(points) == 0:
+            return True
+        status, msg = self.db.write_points(points)
+        if status:
+            self.log.debug(f"Flushed {len(points)} points")
+            self.replay()
+            return True
+        if self.db.is_ready():
+            # Database is up but rejected the points, retrying won't help
+            self.log.error(f"Failed to write {len(points)} points: {msg}")
+            return False
+        self.log.warning(f"Database unavailable, journaling {len(points)} points: {msg}")
+        self._journal_write(points)
+        return False
+
+    def _journal_write(self, points):
+        if self.journal_path is None:
+            self.log.error(f"No journal configured, dropping {len(points)} points")
+            return
+        with self.journal_lock:
+            try:
+                if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) >= self.max_journal_size:
+                    self.log.error(f"Journal full, dropping {len(points)} points")
+                    return
+                os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+                with open(self.journal_path, 'a') as f:
+                    for point in points:
+                        f.write(json.dumps(point) + '\n')
+            except Exception as e:
+                self.log.error(f"Failed to write journal: {e}")
+
+    @log_error
+    def replay(self):
+        if self.journal_path is None or not os.path.exists(self.journal_path):
+            return
+        with self.journal_lock:
+            start = None
+            end = None
+            with open(self.journal_path, 'r') as f:
+                points = []
+                for line in f:
+                    try:
+                        point = json.loads(line)
+                    except ValueError:
+                        # Partially written line from an interrupted write
+                        continue
+                    points.append(point)
+                    start = point['time'] if start is None else min(start, point['time'])
+                    end = point['time'] if end is None else max(end, point['time'])
+                    # Points already written before a failed batch are written
+                    # again next time, InfluxDB overwrites identical points
+                    if len(points) >= self.REPLAY_BATCH_SIZE:
+                        if not self._replay_batch(points):
+                            return
+                        points = []
+                if len(points) > 0 and not self._replay_batch(points):
+                    return
+            os.remove(self.journal_path)
+            if start is not None:
+                # Rollups only follow new data, the outage would be missing
+                # from them once raw data expires
+                try:
+                    self.db.rollup_range(start, end)
+                except Exception as e:
+                    self.log.error(f"Failed to roll up replayed points: {e}")
+            # Replayed points land in buckets that may already be cached
+            self.db.invalidate_cache()
+            self.log.info("Journal replayed")
+
+    def _replay_batch(self, points):
+        status, msg = self.db.write_points(points)
+        if status:
+            return True
+        if self.db.is_ready():
+            # Rejected points, skip them rather than block the journal
+            self.log.error(f"Failed to replay {len(points)} points: {msg}")
+            return True
+        self.log.warning(f"Database unavailable, journal replay postponed: {msg}")
+        return False
+
+    def loop(self):
+        while self.running:
+            age = self._oldest_age()
+            if age is None:
+                timeout = self.flush_age
+            else:
+                timeout = max(self.flush_age - age, 0)
+            self.event.wait(timeout)
+            self.event.clear()
+            age = self._oldest_age()
+            if age is not None and (age >= self.flush_age or len(self.queue) >= self.flush_size):
+                self.flush()
+        self.flush()
+
+    @log_error
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    @log_error
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.event.set()
+        self.thread.join()
@@ -0,0 +1,36 @@
+import time
+
+from pm_dashboard.dedup import Deduplicator
+from pm_dashboard.sqlite_database import SQLiteDatabase
+
+SECOND = 1000000000
+# Recent whole minute, so reads come from raw data
+START = int(time.time()) // 60 * 60 - 600
+
+def write(db, dedup, seconds):
+    for second in seconds:
+        points = dedup.filter((START + second) * SECOND, {'cpu_percent': 10.0 + second, 'memory_total': 4096})
+        db.write_points([{'measurement': 'history', 'time': timestamp, 'fields': fields} for timestamp, fields in points])
+
+def test_gap_fills_only_deduplicated_fields(tmp_path):
+    dedup = Deduplicator(['memory_total'], keyframe=300)
+    db = SQLiteDatabase('history', path=str(tmp_path / 'history.db'))
+    db.start()
+    db.fill_window = dedup.keyframe
+    db.fill_seed = dedup.seed
+    db.fill_fields = dedup.deduplicated
+    # Sampler stopped between 10 and 110 seconds
+    write(db, dedup, list(range(0, 10)) + list(range(110, 120)))
+
+    columns, rows = db.get_rows_by_time_range('history', START * SECOND, (START + 120) * SECOND, 'cpu_percent,memory_total')
+    rows = {row[0] - START: dict(zip(columns, row)) for row in rows}
+    assert rows[5]['cpu_percent'] == 15.0
+    assert rows[5]['memory_total'] == 4096
+    assert rows[50]['cpu_percent'] is None
+    assert rows[50]['memory_total'] == 4096
+    assert rows[115]['cpu_percent'] == 125.0
+    assert rows[115]['memory_total'] == 4096
+
+    latest = db.get('history', '*', 20)
+    assert all(point['memory_total'] == 4096 for point in latest)
+    db.close()